@@ -1,13 +1,215 @@
+import asyncio
+import hashlib
+import io
+import time
 import httpx
+import tokenize
 import json # <-- RE-ADDED: Need this for serializing the trace AND parsing the new AI response
-from typing import List # <-- NEW: Import List for type hinting
+from collections import OrderedDict
+from typing import Dict, List, Optional # <-- NEW: Import List for type hinting
+
+from backend.metrics import ai_errors, ai_latency
 
 # httpx handles JSON encoding/decoding automatically.
 
 import os
 API_KEY = os.getenv("GEMINI_API_KEY")
 
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={API_KEY}"
+# AI_BASE_URL can point at a local stub (see loadtest/gemini_stub.py)
+AI_BASE_URL = os.getenv("AI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+AI_MODEL = os.getenv("AI_MODEL", "gemini-2.5-flash-preview-09-2025")
+
+API_URL = f"{AI_BASE_URL}/v1beta/models/{AI_MODEL}:generateContent?key={API_KEY}"
+# Same model, answer streamed as Server-Sent Events
+STREAM_API_URL = f"{AI_BASE_URL}/v1beta/models/{AI_MODEL}:streamGenerateContent?alt=sse&key={API_KEY}"
+
+# --- Shared client, response cache and request coalescing ---
+# One pooled client for the app's lifetime (no TLS handshake per call).
+# Successful responses are cached (TTL + LRU) by the full payload, i.e. prompt,
+# system instruction and generation config; identical requests already in
+# flight share a single upstream call.
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2048"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+# --- Whole-program explanations ---
+# One JSON-mode call explains up to EXPLAIN_BATCH_MAX_LINES distinct lines;
+# the answers are cached per line (same TTL/LRU as above), keyed by the
+# normalized line and its context, so later clicks need no model call.
+EXPLAIN_BATCH_MAX_LINES = int(os.getenv("EXPLAIN_BATCH_MAX_LINES", "150"))
+
+_client: Optional[httpx.AsyncClient] = None
+_response_cache = OrderedDict()  # key -> (expires_at, text)
+_in_flight = {}  # key -> asyncio.Task
+ai_stats = {"upstream_calls": 0, "cache_hits": 0, "coalesced": 0, "line_cache_hits": 0}
+_background_tasks = set()  # Keeps cache-warming tasks alive until they finish
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=20.0,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _payload_key(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[str]:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, text = entry
+    if expires_at < time.monotonic():
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return text
+
+
+def _cache_put(key: str, text: str):
+    _response_cache[key] = (time.monotonic() + AI_CACHE_TTL, text)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > AI_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+
+async def _post_generate(payload: dict, timeout: float) -> str:
+    ai_stats["upstream_calls"] += 1
+    start = time.perf_counter()
+    try:
+        response = await get_client().post(API_URL, json=payload, timeout=timeout)
+        # Raise an error if the request was unsuccessful
+        response.raise_for_status()
+    except Exception:
+        ai_errors.inc("generate")
+        raise
+    finally:
+        ai_latency.observe(time.perf_counter() - start, "generate")
+    result = response.json()
+    # Extract the text from the AI's response
+    return result.get("candidates")[0].get("content").get("parts")[0].get("text")
+
+
+async def generate_text(payload: dict, timeout: float) -> str:
+    """
+    Send a generateContent payload and return the first candidate's text.
+    Served from the response cache when possible; concurrent identical
+    requests wait on the same upstream call. Errors are raised, not cached.
+    """
+    key = _payload_key(payload)
+    cached = _cache_get(key)
+    if cached is not None:
+        ai_stats["cache_hits"] += 1
+        return cached
+
+    task = _in_flight.get(key)
+    if task is not None:
+        ai_stats["coalesced"] += 1
+    else:
+        task = _track_in_flight(key, asyncio.ensure_future(_post_generate(payload, timeout)))
+
+    # shield: a caller going away must not cancel the call others wait on
+    return await asyncio.shield(task)
+
+
+def _track_in_flight(key: str, task: asyncio.Task) -> asyncio.Task:
+    """Let identical requests wait on `task`; cache its answer unless it fails or is empty."""
+    _in_flight[key] = task
+
+    def _done(finished):
+        _in_flight.pop(key, None)
+        if not finished.cancelled() and finished.exception() is None and finished.result():
+            _cache_put(key, finished.result())
+
+    task.add_done_callback(_done)
+    return task
+
+
+async def _stream_generate(payload: dict, timeout: float, pieces: asyncio.Queue) -> str:
+    """
+    Stream an answer from upstream, putting each piece on `pieces` (then
+    None once the stream ends) and returning the whole text.
+    """
+    ai_stats["upstream_calls"] += 1
+    text = []
+    start = time.perf_counter()
+    try:
+        async with get_client().stream("POST", STREAM_API_URL, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                chunk = json.loads(line[len("data:"):])
+                for candidate in chunk.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            text.append(part["text"])
+                            pieces.put_nowait(part["text"])
+    except Exception:
+        ai_errors.inc("stream")
+        raise
+    finally:
+        ai_latency.observe(time.perf_counter() - start, "stream")
+        pieces.put_nowait(None)
+    return "".join(text)
+
+
+async def stream_text(payload: dict, timeout: float):
+    """
+    Like generate_text, but yields the answer in pieces as the model writes it.
+    A cached answer (or one already being fetched, streamed or not) arrives
+    in one piece. The upstream stream runs as its own task, so identical
+    requests wait on it and it still completes (and is cached) if this
+    caller goes away.
+    """
+    key = _payload_key(payload)
+    cached = _cache_get(key)
+    if cached is not None:
+        ai_stats["cache_hits"] += 1
+        yield cached
+        return
+    task = _in_flight.get(key)
+    if task is not None:
+        ai_stats["coalesced"] += 1
+        yield await asyncio.shield(task)
+        return
+
+    pieces = asyncio.Queue()
+    task = _track_in_flight(key, asyncio.ensure_future(_stream_generate(payload, timeout, pieces)))
+    while True:
+        piece = await pieces.get()
+        if piece is None:
+            break
+        yield piece
+    await asyncio.shield(task)  # Raises the upstream error, if any
+
+
+async def _stream_or_fallback(payload: dict, timeout: float, label: str, fallback: str):
+    """stream_text with the same error handling as the non-streaming helpers."""
+    try:
+        async for piece in stream_text(payload, timeout):
+            yield piece
+    except httpx.HTTPStatusError as e:
+        print(f"HTTP Error ({label}): {e.response.status_code}")
+        yield f"Error from AI: {e.response.status_code}"
+    except Exception as e:
+        print(f"AI {label} Error: {e}")
+        yield fallback
 
 # This system prompt guides the AI to be a helpful tutor
 SYSTEM_PROMPT = "You are an expert Python tutor. Explain the following line of code to a beginner in one or two simple sentences, in a friendly and encouraging tone. Do not be overly technical."
@@ -23,6 +225,22 @@ Your job is to provide a high-level, concise summary (2-4 sentences) explaining
 - Be friendly, encouraging, and easy to understand. Do not just repeat the code line by line.
 """
 
+# --- System Prompt for whole-program (batch) explanations ---
+EXPLAIN_PROGRAM_SYSTEM_PROMPT = """
+You are an expert Python tutor. You will be given a beginner's Python program, with line numbers, and a list of line numbers.
+Explain each listed line to a beginner in one or two simple sentences, in a friendly and encouraging tone, using the rest of the program as context. Do not be overly technical.
+Respond in JSON format ONLY: an object mapping each listed line number (as a string) to its explanation. Do not include any other text or markdown.
+
+Example:
+Lines to explain: [1, 3]
+
+Your JSON response:
+{
+  "1": "This creates an empty list called result, ready to be filled.",
+  "3": "Each time through the loop, the doubled number is added to the end of result."
+}
+"""
+
 # --- NEW: System Prompt for the Variable Mapper ---
 VARIABLE_MAPPER_SYSTEM_PROMPT = """
 You are a Python code analyzer. You will be given a user's Python code and a list of its variables.
@@ -46,35 +264,25 @@ Your JSON response:
 }
 """
 
-async def get_ai_explanation(code_line: str) -> str:
-    """
-    Sends a line of code to the Gemini API and returns a simple explanation.
-    """
-    
+def _explanation_payload(code_line: str) -> dict:
     # This is the payload we send to the Gemini API
-    payload = {
+    return {
         "contents": [{ "parts": [{ "text": code_line }] }],
         "systemInstruction": {
             "parts": [{ "text": SYSTEM_PROMPT }]
         }
     }
+
+async def get_ai_explanation(code_line: str) -> str:
+    """
+    Sends a line of code to the Gemini API and returns a simple explanation.
+    """
+    payload = _explanation_payload(code_line)
     
     try:
-        # Use httpx for an asynchronous API call
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.post(
-                API_URL, 
-                json=payload, # This 'json=' is an argument name, not the module
-                headers={"Content-Type": "application/json"}
-            )
-            # Raise an error if the request was unsuccessful
-            response.raise_for_status() 
-            
-            result = response.json() # This '.json()' is a method of the response object
-            
-            # Extract the text from the AI's response
-            text = result.get("candidates")[0].get("content").get("parts")[0].get("text")
-            return text.strip()
+        # Shared pooled client; cached and coalesced
+        text = await generate_text(payload, timeout=15.0)
+        return text.strip()
             
     except httpx.HTTPStatusError as e:
         print(f"HTTP Error: {e.response.status_code} - {e.response.text}")
@@ -83,13 +291,143 @@ async def get_ai_explanation(code_line: str) -> str:
         print(f"AI Explainer Error: {e}") # Log the error to the server console
         return "Error: Could not get explanation at this time."
 
-# --- NEW: Function for getting the overall summary ---
-async def get_ai_summary(code: str, final_step: dict) -> str:
+def stream_ai_explanation(code_line: str):
+    """Async generator over the explanation of a line, as it is written."""
+    return _stream_or_fallback(
+        _explanation_payload(code_line), 15.0, "Explainer", "Error: Could not get explanation at this time."
+    )
+
+# --- Whole-program explanations and the per-line cache ---
+_LAYOUT_TOKENS = {
+    tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER,
+}
+
+def normalize_line(code_line: str) -> str:
+    """The line's tokens separated by single spaces, without comments."""
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(code_line.strip()).readline)
+        parts = [tok.string for tok in tokens if tok.type not in _LAYOUT_TOKENS]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Unbalanced brackets etc.: fall back to collapsing whitespace
+        return " ".join(code_line.split())
+    return " ".join(parts)
+
+def line_cache_keys(lines: List[str]) -> List[Optional[str]]:
     """
-    Sends the full code and the final execution step to the Gemini API
-    and returns a high-level summary.
+    Per-line cache key: the normalized line plus its context, i.e. the
+    header of the enclosing block and the previous code line. None for
+    blank and comment-only lines.
     """
-    
+    keys = []
+    blocks = []  # (indent, normalized header) of the enclosing lines
+    previous = ""
+    for text in lines:
+        normalized = normalize_line(text)
+        if not normalized:
+            keys.append(None)
+            continue
+        indent = len(text) - len(text.lstrip())
+        while blocks and blocks[-1][0] >= indent:
+            blocks.pop()
+        header = blocks[-1][1] if blocks else ""
+        parts = [normalized, header, previous]
+        keys.append("line:" + hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest())
+        blocks.append((indent, normalized))
+        previous = normalized
+    return keys
+
+def cached_line_explanation(code: str, line_number: int) -> Optional[str]:
+    """The cached explanation of a line of `code`, if a batch has covered it."""
+    keys = line_cache_keys(code.splitlines())
+    if not 1 <= line_number <= len(keys) or keys[line_number - 1] is None:
+        return None
+    text = _cache_get(keys[line_number - 1])
+    if text is not None:
+        ai_stats["line_cache_hits"] += 1
+    return text
+
+def _program_payload(lines: List[str], line_numbers: List[int]) -> dict:
+    numbered = "\n".join(f"{n:>4}| {text}" for n, text in enumerate(lines, 1))
+    user_prompt = f"""
+Code:
+---
+{numbered}
+---
+Lines to explain: {line_numbers}
+
+Your JSON response:
+"""
+    return {
+        "contents": [{ "parts": [{ "text": user_prompt }] }],
+        "systemInstruction": {
+            "parts": [{ "text": EXPLAIN_PROGRAM_SYSTEM_PROMPT }]
+        },
+        "generationConfig": {
+            "responseMimeType": "application/json"
+        }
+    }
+
+async def _explain_lines(lines: List[str], line_numbers: List[int]) -> Dict[int, str]:
+    try:
+        answer = json.loads(await generate_text(_program_payload(lines, line_numbers), timeout=60.0))
+    except Exception as e:
+        print(f"AI Program Explainer Error: {e}")
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+    explained = {}
+    for n in line_numbers:
+        text = answer.get(str(n))
+        if isinstance(text, str) and text.strip():
+            explained[n] = text.strip()
+    return explained
+
+async def explain_program(code: str) -> Dict[int, str]:
+    """
+    Explain every code line of a program: {line number: explanation}.
+    Lines already in the per-line cache cost nothing; the rest (each
+    distinct line once) go to the model in one JSON-mode call per
+    EXPLAIN_BATCH_MAX_LINES lines. Lines the model skipped, or all of them
+    when the call fails, are missing from the result.
+    """
+    lines = code.splitlines()
+    explanations = {}
+    todo = {}  # cache key -> line numbers sharing it
+    for n, key in enumerate(line_cache_keys(lines), 1):
+        if key is None:
+            continue
+        if key in todo:
+            todo[key].append(n)
+            continue
+        text = _cache_get(key)
+        if text is not None:
+            ai_stats["line_cache_hits"] += 1
+            explanations[n] = text
+        else:
+            todo[key] = [n]
+
+    firsts = [numbers[0] for numbers in todo.values()]
+    chunks = [firsts[i:i + EXPLAIN_BATCH_MAX_LINES] for i in range(0, len(firsts), EXPLAIN_BATCH_MAX_LINES)]
+    explained = {}
+    for result in await asyncio.gather(*[_explain_lines(lines, chunk) for chunk in chunks]):
+        explained.update(result)
+    for key, numbers in todo.items():
+        text = explained.get(numbers[0])
+        if text is None:
+            continue
+        _cache_put(key, text)
+        for n in numbers:
+            explanations[n] = text
+    return dict(sorted(explanations.items()))
+
+def warm_line_cache(code: str):
+    """Start explain_program in the background (its result fills the cache)."""
+    task = asyncio.ensure_future(explain_program(code))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+# --- NEW: Function for getting the overall summary ---
+def _summary_payload(code: str, final_step: dict) -> dict:
     # Create a clean prompt for the AI
     user_prompt = f"""
 Here is my Python code:
@@ -105,24 +443,23 @@ Here is the final step of the execution trace, which shows the final variables,
 Please provide a summary of what this code did, based on its final state.
 """
     
-    payload = {
+    return {
         "contents": [{ "parts": [{ "text": user_prompt }] }],
         "systemInstruction": {
             "parts": [{ "text": SUMMARY_SYSTEM_PROMPT }]
         }
     }
+
+async def get_ai_summary(code: str, final_step: dict) -> str:
+    """
+    Sends the full code and the final execution step to the Gemini API
+    and returns a high-level summary.
+    """
+    payload = _summary_payload(code, final_step)
     
     try:
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            response = await client.post(
-                API_URL, 
-                json=payload, 
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            result = response.json()
-            text = result.get("candidates")[0].get("content").get("parts")[0].get("text")
-            return text.strip()
+        text = await generate_text(payload, timeout=20.0)
+        return text.strip()
             
     except httpx.HTTPStatusError as e:
         print(f"HTTP Error (Summary): {e.response.status_code} - {e.response.text}")
@@ -131,6 +468,12 @@ Please provide a summary of what this code did, based on its final state.
         print(f"AI Summary Error: {e}")
         return "Error: Could not get summary at this time."
 
+def stream_ai_summary(code: str, final_step: dict):
+    """Async generator over the summary, as it is written."""
+    return _stream_or_fallback(
+        _summary_payload(code, final_step), 20.0, "Summary", "Error: Could not get summary at this time."
+    )
+
 
 # --- NEW: Function for the Variable Mapper ---
 async def get_ai_variable_map(code: str, var_names: List[str]) -> dict:
@@ -163,20 +506,11 @@ Your JSON response:
     }
     
     try:
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            response = await client.post(
-                API_URL, 
-                json=payload, 
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            # The AI's response text *is* the JSON
-            text = result.get("candidates")[0].get("content").get("parts")[0].get("text")
-            
-            # Parse the JSON string into a Python dict
-            return json.loads(text)
+        # The AI's response text *is* the JSON
+        text = await generate_text(payload, timeout=20.0)
+
+        # Parse the JSON string into a Python dict
+        return json.loads(text)
             
     except Exception as e:
         print(f"AI Variable Map Error: {e}")
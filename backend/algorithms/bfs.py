@@ -1,45 +1,64 @@
+from bisect import insort
 from collections import deque
 
 def bfs_final(graph, start):
     """Return only the final BFS order (fallback)."""
-    visited = set()
+    visited = {start}
     queue = deque([start])
     order = []
 
     while queue:
         node = queue.popleft()
-        if node not in visited:
-            visited.add(node)
-            order.append(node)
-            queue.extend(graph.get(node, []))
+        order.append(node)
+        for neighbor in graph.get(node, []):
+            if neighbor not in visited:
+                visited.add(neighbor)
+                queue.append(neighbor)
 
     return order
 
 
+def bfs_events(graph, start):
+    """
+    Yield one delta per visited node: {"current": node, "enqueued": [...]}.
+    `current` was taken from the front of the queue, then `enqueued` (its
+    neighbors not seen before) were appended to the back. O(V + E) overall,
+    for a dict adjacency or a CSRGraph.
+    """
+    enqueued = {start}
+    queue = deque([start])
+
+    while queue:
+        node = queue.popleft()
+        added = []
+        for neighbor in graph.get(node, []):
+            # Checked one by one: a neighbor may be listed twice
+            if neighbor not in enqueued:
+                enqueued.add(neighbor)
+                added.append(neighbor)
+        queue.extend(added)
+        yield {"current": node, "enqueued": added}
+
+
 def bfs_steps(graph, start):
     """Return step-by-step BFS states for visualization."""
-    visited = set()
     queue = deque([start])
+    visited = []  # Kept sorted
     order = []
     steps = []
 
-    while queue:
+    for event in bfs_events(graph, start):
         node = queue.popleft()
-        if node not in visited:
-            visited.add(node)
-            order.append(node)
-            
-            # Save snapshot of current state AFTER processing current node
-            steps.append({
-                "current": node,
-                "queue": list(queue),
-                "visited": sorted(list(visited)),
-                "order_so_far": list(order)
-            })
-            
-            # Add unvisited neighbors to queue
-            for neighbor in graph.get(node, []):
-                if neighbor not in visited and neighbor not in queue:
-                    queue.append(neighbor)
+        insort(visited, node)
+        order.append(node)
+
+        # Save snapshot of current state AFTER processing current node
+        steps.append({
+            "current": node,
+            "queue": list(queue),
+            "visited": list(visited),
+            "order_so_far": list(order)
+        })
+        queue.extend(event["enqueued"])
 
     return {"steps": steps, "final_order": order}
@@ -1,29 +1,53 @@
+from bisect import insort
+
+
+def dfs_events(graph, start):
+    """
+    Yield one delta per visited node:
+    {"current": node, "skipped": k, "pushed": [...]}.
+    `skipped` already-visited entries were popped off the stack, then
+    `current`, then `pushed` (its unvisited neighbors, in push order) went
+    on top. O(V + E) overall, for a dict adjacency or a CSRGraph.
+    """
+    visited = set()
+    stack = [start]
+    skipped = 0
+
+    while stack:
+        node = stack.pop()
+
+        if node in visited:
+            skipped += 1
+            continue
+        visited.add(node)
+
+        # Reverse to maintain a more intuitive traversal order
+        pushed = [neighbor for neighbor in reversed(graph.get(node, [])) if neighbor not in visited]
+        stack.extend(pushed)
+        yield {"current": node, "skipped": skipped, "pushed": pushed}
+        skipped = 0
+
+
 def dfs_steps(graph, start):
     """Return step-by-step DFS states for visualization."""
-    visited = set()
     stack = [start]
+    visited = []  # Kept sorted
     order = []
     steps = []
 
-    while stack:
+    for event in dfs_events(graph, start):
+        del stack[len(stack) - event["skipped"]:]
         node = stack.pop()
+        insort(visited, node)
+        order.append(node)
 
-        if node not in visited:
-            visited.add(node)
-            order.append(node)
-
-            # Save a snapshot of the current state
-            steps.append({
-                "current": node,
-                "stack": list(stack),
-                "visited": sorted(list(visited)),
-                "order_so_far": list(order)
-            })
-
-            # Add unvisited neighbors to the stack
-            # Reverse to maintain a more intuitive traversal order
-            for neighbor in reversed(graph.get(node, [])):
-                if neighbor not in visited:
-                    stack.append(neighbor)
+        # Save a snapshot of the current state
+        steps.append({
+            "current": node,
+            "stack": list(stack),
+            "visited": list(visited),
+            "order_so_far": list(order)
+        })
+        stack.extend(event["pushed"])
 
     return {"steps": steps, "final_order": order}
@@ -0,0 +1,69 @@
+from array import array
+
+
+class CSRGraph:
+    """
+    Compressed sparse row adjacency for large graphs (10^5-10^6 edges).
+    Nodes are the integers 0..n-1; the neighbors of node u are
+    targets[offsets[u]:offsets[u + 1]], in insertion order.
+    Two flat integer arrays instead of a dict of lists.
+    """
+
+    def __init__(self, offsets: array, targets: array):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, n: int, edges, directed: bool = True) -> "CSRGraph":
+        """Build from (u, v) pairs; undirected graphs store both directions."""
+        edges = list(edges)
+        degree = [0] * (n + 1)
+        for u, v in edges:
+            degree[u + 1] += 1
+            if not directed:
+                degree[v + 1] += 1
+        for u in range(n):
+            degree[u + 1] += degree[u]
+        offsets = array("q", degree)
+
+        fill = degree[:-1]  # Next free slot of each node
+        targets = array("q", bytes(8 * offsets[-1]))
+        for u, v in edges:
+            targets[fill[u]] = v
+            fill[u] += 1
+            if not directed:
+                targets[fill[v]] = u
+                fill[v] += 1
+        return cls(offsets, targets)
+
+    @classmethod
+    def from_adjacency(cls, adjacency: dict) -> "CSRGraph":
+        """Build from {node: [neighbors]} with integer nodes."""
+        nodes = [int(node) for node in adjacency]
+        for neighbors in adjacency.values():
+            nodes.extend(int(v) for v in neighbors)
+        n = max(nodes) + 1 if nodes else 0
+
+        offsets = array("q", [0]) * (n + 1)
+        targets = array("q")
+        lists = {int(node): neighbors for node, neighbors in adjacency.items()}
+        for u in range(n):
+            targets.extend(int(v) for v in lists.get(u, ()))
+            offsets[u + 1] = len(targets)
+        return cls(offsets, targets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def neighbors(self, node: int) -> array:
+        if not 0 <= node < len(self.offsets) - 1:
+            return array("q")
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def get(self, node, default=None):
+        """Dict-style lookup, so traversals take either representation."""
+        return self.neighbors(node)
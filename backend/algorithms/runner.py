@@ -0,0 +1,83 @@
+import os
+from array import array
+from typing import Any, Dict, List
+
+from backend.algorithms.bfs import bfs_events, bfs_steps
+from backend.algorithms.dfs import dfs_events, dfs_steps
+from backend.algorithms.graph import CSRGraph
+from backend.algorithms.wavearray import wavearray_steps
+
+# --- Algorithm jobs ---
+# Full-state steps cost O(V) each, so bigger graphs must ask for deltas
+FULL_STEPS_MAX_NODES = int(os.getenv("FULL_STEPS_MAX_NODES", "5000"))
+# Most jobs accepted by one batch request
+ALGORITHM_BATCH_MAX = int(os.getenv("ALGORITHM_BATCH_MAX", "1000"))
+
+_GRAPH_ALGORITHMS = {"bfs": (bfs_steps, bfs_events), "dfs": (dfs_steps, dfs_events)}
+
+
+def normalize_graph(graph: Dict[Any, List[int]]) -> Dict[int, List[int]]:
+    """JSON object keys are strings; the traversals compare them with int neighbors."""
+    try:
+        return {int(node): list(neighbors) for node, neighbors in graph.items()}
+    except (TypeError, ValueError):
+        raise ValueError("Graph nodes must be integers")
+
+
+def job_graph(job: Dict[str, Any]):
+    """The job's graph: a CSRGraph when it came as "offsets" + "targets", else a dict."""
+    if job.get("offsets") is not None:
+        offsets = array("q", job["offsets"])
+        targets = array("q", job.get("targets") or [])
+        if not offsets or offsets[0] != 0 or offsets[-1] != len(targets):
+            raise ValueError("CSR offsets must start at 0 and end at len(targets)")
+        return CSRGraph(offsets, targets)
+    return normalize_graph(job.get("graph") or {})
+
+
+def has_node(graph, node: int) -> bool:
+    """Whether `node` is in the graph: 0..n-1 for a CSRGraph, a key or a neighbor for a dict."""
+    if isinstance(graph, CSRGraph):
+        return 0 <= node < len(graph)
+    return node in graph or any(node in neighbors for neighbors in graph.values())
+
+
+def run_algorithm(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one job: {"algorithm": "bfs" | "dfs", "graph" (or "offsets" +
+    "targets"), "start", "delta"} or {"algorithm": "wavearray", "numbers"}.
+    With "delta", graph jobs return "events" (see bfs_events / dfs_events)
+    instead of full-state "steps".
+    """
+    algorithm = job.get("algorithm")
+    if algorithm == "wavearray":
+        return wavearray_steps(list(job.get("numbers") or []))
+    if algorithm not in _GRAPH_ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+
+    graph = job_graph(job)
+    start = job.get("start")
+    if start is None:
+        raise ValueError(f"{algorithm} needs a start node")
+    if not has_node(graph, start):
+        raise ValueError(f"Start node {start} is not in the graph")
+    steps_fn, events_fn = _GRAPH_ALGORITHMS[algorithm]
+    if not job.get("delta"):
+        if len(graph) > FULL_STEPS_MAX_NODES:
+            raise ValueError(
+                f"Graph has {len(graph)} nodes; full steps are limited to {FULL_STEPS_MAX_NODES}, use delta"
+            )
+        return steps_fn(graph, start)
+    events = list(events_fn(graph, start))
+    return {"events": events, "final_order": [event["current"] for event in events]}
+
+
+def run_algorithm_batch(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Run jobs in order; a failing job reports {"error": ...} instead of failing the batch."""
+    results = []
+    for job in jobs:
+        try:
+            results.append(run_algorithm(job))
+        except (ValueError, TypeError, RecursionError) as e:
+            results.append({"error": str(e)})
+    return results
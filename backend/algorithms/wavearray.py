@@ -1,22 +1,36 @@
-def wavearray_final(arr):
-    """Return the final wave array (fallback)."""
-    n = len(arr)
-    for i in range(0, n-1, 2):
-        arr[i], arr[i+1] = arr[i+1], arr[i]
-    return arr
+import os
 
+# Optional: NumPy swaps large arrays in one vectorized step
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def wavearray_steps(arr):
-    """Return step-by-step transformations of the array for visualization."""
-    steps = []
-    arr_copy = arr[:]  # don’t modify original input
+# Arrays at least this long take the NumPy path (when NumPy is installed)
+WAVEARRAY_NUMPY_MIN = int(os.getenv("WAVEARRAY_NUMPY_MIN", "10000"))
 
-    for i in range(0, len(arr_copy)-1, 2):
-        arr_copy[i], arr_copy[i+1] = arr_copy[i+1], arr_copy[i]
-        steps.append({
-            "step": i//2 + 1,
-            "array": arr_copy[:]
-        })
 
-    return {"steps": steps, "final_array": arr_copy}
+def wavearray_final(arr):
+    """Return the final wave array as a new list; `arr` is left as it is."""
+    even = len(arr) - len(arr) % 2  # A trailing odd element stays put
+    if np is not None and len(arr) >= WAVEARRAY_NUMPY_MIN:
+        values = np.array(arr)
+        values[0:even:2], values[1:even:2] = values[1:even:2], values[0:even:2].copy()
+        return values.tolist()
+    result = list(arr)
+    result[0:even:2], result[1:even:2] = result[1:even:2], result[0:even:2]
+    return result
+
 
+def wavearray_swaps(n):
+    """Index pairs swapped, in order, to turn an array of length n into a wave."""
+    return [[i, i + 1] for i in range(0, n - 1, 2)]
+
+
+def wavearray_steps(arr):
+    """
+    Return step-by-step transformations of the array for visualization:
+    each step is the [i, j] pair of indices swapped, so step k's array is
+    the input with the first k swaps applied.
+    """
+    return {"steps": wavearray_swaps(len(arr)), "final_array": wavearray_final(arr)}
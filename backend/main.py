@@ -1,18 +1,52 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
-from fastapi import FastAPI
+from typing import List, Dict, Any, Literal, Optional, Union
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
 # --- Import AI and tracing functions ---
-from backend.tracer import trace_python_code
-from backend.ai_explainer import get_ai_explanation, get_ai_summary, get_ai_variable_map
+from backend.tracer import DEFAULT_KEYFRAME_INTERVAL, inspect_value
+from backend.worker_pool import trace_pool, PoolBusyError
+from backend.trace_cache import trace_cache, trace_cache_key, is_cacheable
+from backend.trace_store import trace_store, TRACE_WINDOW_LIMIT
+from backend.trace_encoding import trace_response, brotli, msgpack
+from backend.trace_sessions import trace_sessions, reusable_prefix, splice_steps
+from backend.metrics import MetricsMiddleware, phase, record_phase, render_metrics, slow_profiles, trace_step_counts
+from backend.algorithms.runner import run_algorithm, run_algorithm_batch, ALGORITHM_BATCH_MAX
+from backend.algorithms.wavearray import np
+from backend.structure_classifier import (
+    classify_variables, predict_variable_names, ambiguous_variable_names, CLASSIFIER_CONFIDENCE,
+)
+from backend.ai_explainer import (
+    get_ai_explanation, get_ai_summary, get_ai_variable_map, stream_ai_explanation, stream_ai_summary,
+    close_client, ai_stats, cached_line_explanation, explain_program, warm_line_cache,
+)
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 BACKEND_DIR = PROJECT_ROOT / "backend"
 CPP_DIR = BACKEND_DIR / "cpp"
 
-app = FastAPI(title="Algorithms API", version="1.0.0")
+def report_missing_packages():
+    """Name the optional packages (backend/requirements-optional.txt) that aren't installed."""
+    missing = [name for name, module in (("msgpack", msgpack), ("brotli", brotli), ("numpy", np)) if module is None]
+    if missing:
+        print(f"Optional packages not installed, their features are disabled: {', '.join(missing)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    report_missing_packages()
+    # Pre-start the tracing workers so the first request doesn't pay for it
+    trace_pool.start()
+    yield
+    trace_pool.shutdown()
+    await close_client()
+
+app = FastAPI(title="Algorithms API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,84 +55,649 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Server-Timing header, request counters and (optional) slow-request profiles
+app.add_middleware(MetricsMiddleware)
+
+# --- Worker Pool Errors ---
+WORKER_CRASH_MESSAGE = "Execution crashed the worker process."
+
+@app.exception_handler(PoolBusyError)
+async def pool_busy_handler(request: Request, exc: PoolBusyError) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(BrokenProcessPool)
+async def worker_crash_handler(request: Request, exc: BrokenProcessPool) -> JSONResponse:
+    return JSONResponse(status_code=500, content={"detail": WORKER_CRASH_MESSAGE})
 
 # --- Request Models ---
 class WaveArrayRequest(BaseModel):
     numbers: List[int]
 
 class GraphRequest(BaseModel):
-    graph: Dict[str, List[int]]
+    # Adjacency list, or (for large graphs) CSR arrays: the neighbors of
+    # node u are targets[offsets[u]:offsets[u + 1]]
+    graph: Optional[Dict[str, List[int]]] = None
+    offsets: Optional[List[int]] = None
+    targets: Optional[List[int]] = None
     start: int
+    # Return per-node deltas ("events") instead of full-state steps
+    delta: bool = False
+
+class AlgorithmJob(BaseModel):
+    algorithm: Literal["bfs", "dfs", "wavearray"]
+    graph: Optional[Dict[str, List[int]]] = None
+    offsets: Optional[List[int]] = None
+    targets: Optional[List[int]] = None
+    start: Optional[int] = None
+    numbers: Optional[List[int]] = None
+    delta: bool = False
+
+class AlgorithmBatchRequest(BaseModel):
+    jobs: List[AlgorithmJob]
 
 class CodeExecutionRequest(BaseModel):
     code: str
     inputs: List[str] = []  # For handling user input
+    # 1 = full variables on every step (default), 2 = keyframes + deltas
+    trace_format: Literal[1, 2] = 1
+    keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL
+    # Overrides for max_length / max_depth / max_nodes (capped server-side).
+    # v1 tree traces are uncapped unless this is given ({} = the defaults)
+    snapshot_limits: Optional[Dict[str, int]] = None
+    # "tree" = nested values, "heap" = shared object table with references
+    snapshot_mode: Literal["tree", "heap"] = "tree"
+    # Overrides for max_steps / max_seconds / max_trace_bytes (capped server-side).
+    # max_steps counts steps of the trace: lines collapsed by summarize_loops
+    # only count against max_seconds
+    trace_limits: Optional[Dict[str, float]] = None
+    # Collapse long loops into "collapsed" marker steps
+    summarize_loops: bool = False
+    # Keep the trace server-side and return only its first `initial_steps`
+    # steps plus a trace_id for GET /python/trace/{trace_id}/steps
+    store: bool = False
+    initial_steps: int = 100
+    # Editing session: a resubmission reuses the steps the edit can't affect
+    session_id: Optional[str] = None
+    # Step over: trace only these functions / all but these / no functions;
+    # calls into the others show up as "call" + "return" steps
+    trace_functions: Optional[List[str]] = None
+    skip_functions: Optional[List[str]] = None
+    step_over_calls: bool = False
+    # Serialize only these variables / variables of these types; the others
+    # appear as {"__unwatched__": type name}
+    watch: Optional[List[str]] = None
+    watch_types: Optional[List[str]] = None
+
+class TraceRangeRequest(CodeExecutionRequest):
+    # Step numbers from a "collapsed" marker (inclusive)
+    start: int
+    stop: int
 
 class ExplainCodeRequest(BaseModel):
-    code_line: str
+    code_line: Optional[str] = None
+    # Or a line of a whole program: answered from the per-line cache that
+    # /python/explain/batch fills (and filling it on a miss)
+    code: Optional[str] = None
+    line_number: Optional[int] = None
+    # Or a step of a stored trace (see `store`), whose line is explained
+    trace_id: Optional[str] = None
+    step: Optional[int] = None
+    stream: bool = False  # Send the answer as it is written
+
+class ExplainBatchRequest(BaseModel):
+    code: Optional[str] = None
+    trace_id: Optional[str] = None  # Or the program of a stored trace
+
+class VariableMapRequest(BaseModel):
+    code: str
+    variables: Optional[List[str]] = None  # Defaults to the names found in the code
 
 class SummarizeCodeRequest(BaseModel):
+    code: Optional[str] = None
+    # Only the last step is used; a stored trace can be named by trace_id instead
+    trace: Optional[List[Dict[str, Any]]] = None
+    trace_id: Optional[str] = None
+    stream: bool = False  # Send the answer as it is written
+
+class ValueRequest(BaseModel):
     code: str
-    trace: List[Dict[str, Any]]
+    inputs: List[str] = []
+    step: int  # Index of the step in the trace
+    path: List[Union[str, int]]  # "path" of a truncation marker
+    offset: int = 0
+    limit: int = 100
+    snapshot_limits: Optional[Dict[str, int]] = None
+    trace_limits: Optional[Dict[str, float]] = None
+    # Same as for the trace: they decide which steps it has
+    trace_functions: Optional[List[str]] = None
+    skip_functions: Optional[List[str]] = None
+    step_over_calls: bool = False
+
+# -----------------------------------------------------
+# Tracing helpers
+# -----------------------------------------------------
+def trace_options(req: CodeExecutionRequest) -> Dict[str, Any]:
+    """Keyword arguments for trace_python_code (also part of the cache key)."""
+    return {
+        "trace_format": req.trace_format,
+        "keyframe_interval": req.keyframe_interval,
+        "snapshot_limits": req.snapshot_limits,
+        "snapshot_mode": req.snapshot_mode,
+        "trace_limits": req.trace_limits,
+        "summarize_loops": req.summarize_loops,
+        "trace_functions": req.trace_functions,
+        "skip_functions": req.skip_functions,
+        "step_over_calls": req.step_over_calls,
+        "watch": req.watch,
+        "watch_types": req.watch_types,
+    }
+
+def cached_trace_key(req: CodeExecutionRequest):
+    """Cache key for this request, or None when its trace must not be cached."""
+    if not is_cacheable(req.code):
+        return None
+    return trace_cache_key(req.code, req.inputs, trace_options(req))
+
+async def run_trace(req: CodeExecutionRequest) -> Dict[str, Any]:
+    # Identical submissions (same code + inputs) are served from the cache
+    key = cached_trace_key(req)
+    if key is not None:
+        with phase("cache"):
+            cached = trace_cache.get(key)
+        if cached is not None:
+            remember_session_trace(req, cached)
+            return cached
+
+    # Run tracer in a worker process (keeps the event loop free)
+    with phase("trace"):
+        trace_data = await incremental_trace(req)
+        if trace_data is None:
+            trace_data = await trace_pool.trace(req.code, req.inputs, **trace_options(req))
+    record_trace_timings(trace_data)
+    trace_step_counts.observe(len(trace_data.get("steps", [])))
+    # A run cut off by the clock may get further next time
+    timed_out = trace_data.get("limit_exceeded", {}).get("limit") == "max_seconds"
+    if key is not None and not timed_out:
+        trace_cache.put(key, trace_data)
+    remember_session_trace(req, trace_data)
+    return trace_data
+
+def record_trace_timings(trace_data: Dict[str, Any]):
+    """Move the worker's own timings out of the trace and into the request phases."""
+    timings = trace_data.pop("timings", None) or {}
+    for name, seconds in timings.items():
+        record_phase(name, seconds)
+
+def _incremental_ok(req: CodeExecutionRequest) -> bool:
+    # Only deterministic runs whose steps don't depend on earlier steps
+    # (heap refs are numbered, summarized loops are sampled) can be spliced
+    return (
+        req.session_id is not None and is_cacheable(req.code)
+        and req.snapshot_mode == "tree" and not req.summarize_loops
+    )
+
+def remember_session_trace(req: CodeExecutionRequest, trace_data: Dict[str, Any]):
+    if _incremental_ok(req) and not trace_data.get("limit_exceeded"):
+        trace_sessions.remember(req.session_id, req.code, req.inputs, trace_options(req), trace_data)
+
+async def incremental_trace(req: CodeExecutionRequest) -> Optional[Dict[str, Any]]:
+    """
+    Re-trace an edited program by reusing the previous trace of the session
+    up to the first execution of a changed line. The new code still runs
+    from the start (nothing can be restored mid-run), but the reused steps
+    are only checked against the line sequence, not serialized.
+    Returns None when a full run is needed.
+    """
+    if not _incremental_ok(req):
+        return None
+    previous = trace_sessions.get(req.session_id)
+    options = trace_options(req)
+    if previous is None or previous["inputs"] != req.inputs or previous["options"] != options:
+        return None
+    prefix, lines = reusable_prefix(previous["code"], req.code, previous["steps"])
+    if not prefix:
+        return None
+
+    rest = await trace_pool.trace(req.code, req.inputs, fast_forward=lines, **options)
+    if rest.get("prefix_mismatch"):
+        trace_sessions.mismatches += 1
+        return None
+    trace_sessions.reused_steps += len(prefix)
+    steps = splice_steps(prefix, rest["steps"], req.trace_format, req.keyframe_interval)
+    return {**rest, "steps": steps}
 
 # -----------------------------------------------------
 # NEW — Main Visualization Endpoint (Async)
 # -----------------------------------------------------
 @app.post("/python/visualize")
-async def visualize_py(req: CodeExecutionRequest) -> Dict[str, Any]:
-
-    # Run tracer
-    trace_data = trace_python_code(req.code, req.inputs)
+async def visualize_py(req: CodeExecutionRequest, request: Request):
+    """
+    Trace the code. JSON by default; MessagePack and a columnar layout are
+    available via Accept, gzip/brotli via Accept-Encoding (see trace_encoding).
+    """
 
-    variable_map = {}
+    early_names, early_map = start_early_map(req.code)
     try:
-        if trace_data.get("steps"):
-            final_vars = trace_data["steps"][-1].get("variables", {})
-            var_names = list(final_vars.keys())
+        trace_data = await run_trace(req)
+    except BaseException:
+        cancel_early_map(early_map)
+        raise
+
+    final_vars = trace_data["steps"][-1].get("variables", {}) if trace_data.get("steps") else {}
+    trace_data["variable_map"] = await finish_variable_map(req.code, final_vars, early_names, early_map)
+    if req.store:
+        trace_data = store_trace(req, trace_data)
+    return trace_response(trace_data, request)
+
+def store_trace(req: CodeExecutionRequest, trace_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep the trace server-side; the response carries only its first window."""
+    trace_id = trace_store.put(req.code, req.inputs, trace_data)
+    total_steps = len(trace_data.get("steps", []))
+    stored = {k: v for k, v in trace_data.items() if k != "steps"}
+    stored.update({
+        "format": 1,  # Windows are always full-state steps
+        "trace_id": trace_id,
+        "total_steps": total_steps,
+        "steps": trace_store.window(trace_id, 0, max(0, req.initial_steps) - 1),
+    })
+    return stored
 
-            if var_names:
-                variable_map = await get_ai_variable_map(req.code, var_names)
+def start_early_map(code: str):
+    """
+    Ask the AI mapper about the ambiguous names while the code executes, so
+    they cost max(trace, AI) instead of their sum. Returns (names, task or None).
+    """
+    names = ambiguous_variable_names(code)
+    if not names:
+        return names, None
+    return names, asyncio.ensure_future(ai_variable_labels(code, names))
 
+def cancel_early_map(early_map: Optional[asyncio.Future]):
+    if early_map is not None:
+        early_map.cancel()
+
+async def finish_variable_map(
+    code: str, final_vars: Dict[str, Any], early_names: List[str], early_map: Optional[asyncio.Future],
+) -> Dict[str, str]:
+    """
+    Label the final variables locally and ask the AI only about the ones the
+    values and the AST can't settle. The early request is reused when it
+    covers all of them and cancelled otherwise.
+    """
+    local = classify_variables(code, list(final_vars), final_vars)
+    variable_map = {name: result["type"] for name, result in local.items()}
+    unsure = [name for name, result in local.items() if result["confidence"] < CLASSIFIER_CONFIDENCE]
+    if not unsure:
+        cancel_early_map(early_map)
+        return variable_map
+
+    with phase("ai_map"):
+        if early_map is not None and set(unsure) <= set(early_names):
+            ai_map = await early_map
+        else:
+            cancel_early_map(early_map)
+            ai_map = await ai_variable_labels(code, unsure)
+    variable_map.update({name: label for name, label in ai_map.items() if name in unsure})
+    return variable_map
+
+async def ai_variable_labels(code: str, var_names: List[str]) -> Dict[str, str]:
+    """AI labels for these names; empty when the mapper fails."""
+    try:
+        return await get_ai_variable_map(code, var_names)
     except Exception as e:
         print(f"Variable mapping failed: {e}")
+        return {}
 
-    trace_data["variable_map"] = variable_map
-    return trace_data
+async def build_variable_map(code: str, var_names: List[str], values: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """
+    Label each variable (graph, stack, queue, ...). The local AST classifier
+    answers most of them; only low-confidence ones go to the AI mapper.
+    """
+    if not var_names:
+        return {}
+
+    local = classify_variables(code, var_names, values)
+    variable_map = {
+        name: result["type"] for name, result in local.items()
+        if result["confidence"] >= CLASSIFIER_CONFIDENCE
+    }
+    unsure = [name for name in var_names if name not in variable_map]
+    if unsure:
+        ai_map = await ai_variable_labels(code, unsure)
+        variable_map.update({name: label for name, label in ai_map.items() if name in unsure})
+        # Keep the local best guess for anything the AI didn't label
+        for name in unsure:
+            variable_map.setdefault(name, local[name]["type"])
+    return variable_map
+
+# -----------------------------------------------------
+# NEW — Streaming Visualization Endpoint
+# -----------------------------------------------------
+async def _replay(batches):
+    for batch in batches:
+        yield batch
+
+def _format_event(event: Dict[str, Any], sse: bool) -> str:
+    data = json.dumps(event)
+    if sse:
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@app.post("/python/visualize/stream")
+async def visualize_stream_py(req: CodeExecutionRequest, request: Request):
+    """
+    Same trace as /python/visualize, sent step by step while the code runs.
+    NDJSON by default, Server-Sent Events when the client accepts text/event-stream.
+    Events: "start", one "step" per step, then "result" and "variable_map".
+    """
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def events():
+        early_names, early_map = start_early_map(req.code)
+        yield _format_event({"type": "start", "format": req.trace_format}, sse)
+        final_vars = {}
+        key = cached_trace_key(req)
+        cached = trace_cache.get(key) if key is not None else None
+        if cached is not None:
+            # Replay a cached trace in the same shape as a live one
+            cached_steps = cached.pop("steps", [])
+            batches = [("steps", cached_steps), ("result", cached)]
+            source = _replay(batches)
+        else:
+            source = trace_pool.stream_trace(req.code, req.inputs, **trace_options(req))
+        try:
+            async for kind, payload in source:
+                if kind == "steps":
+                    for step in payload:
+                        if "variables" in step:
+                            final_vars = step["variables"]
+                        yield _format_event({"type": "step", "step": step}, sse)
+                else:
+                    record_trace_timings(payload)
+                    payload.pop("steps", None)
+                    yield _format_event({"type": "result", **payload}, sse)
+        except PoolBusyError as e:
+            yield _format_event({"type": "result", "error": str(e), "final_output": ""}, sse)
+        except BrokenProcessPool:
+            yield _format_event({"type": "result", "error": WORKER_CRASH_MESSAGE, "final_output": ""}, sse)
+        except BaseException:
+            # Client went away
+            cancel_early_map(early_map)
+            raise
+
+        variable_map = await finish_variable_map(req.code, final_vars, early_names, early_map)
+        yield _format_event({"type": "variable_map", "variable_map": variable_map}, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+# -----------------------------------------------------
+# Stored Trace Endpoints (random access into a stored trace)
+# -----------------------------------------------------
+@app.get("/python/trace/{trace_id}")
+def trace_info(trace_id: str) -> Dict[str, Any]:
+    entry = trace_store.get(trace_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired trace_id")
+    return {
+        "trace_id": trace_id,
+        "total_steps": len(entry["steps"]),
+        "error": entry["error"],
+        "final_output": entry["final_output"],
+        "limit_exceeded": entry["limit_exceeded"],
+    }
+
+@app.get("/python/trace/{trace_id}/steps")
+def trace_steps(
+    trace_id: str,
+    request: Request,
+    start: int = Query(0, alias="from"),
+    stop: Optional[int] = Query(None, alias="to"),
+):
+    """Full-state steps from..to (inclusive, at most TRACE_WINDOW_LIMIT)."""
+    if stop is None:
+        stop = start + TRACE_WINDOW_LIMIT - 1
+    steps = trace_store.window(trace_id, start, stop)
+    if steps is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired trace_id")
+    total_steps = len(trace_store.get(trace_id)["steps"])
+    window = {"trace_id": trace_id, "from": start, "to": start + len(steps) - 1, "total_steps": total_steps, "steps": steps}
+    return trace_response(window, request)
+
+# -----------------------------------------------------
+# Step Range Endpoint (full detail for a collapsed loop)
+# -----------------------------------------------------
+@app.post("/python/visualize/range")
+async def visualize_range_py(req: TraceRangeRequest, request: Request):
+    if req.start < 0 or req.stop < req.start:
+        raise HTTPException(status_code=422, detail="start/stop must satisfy 0 <= start <= stop")
+    options = {**trace_options(req), "summarize_loops": False, "step_range": (req.start, req.stop)}
+    trace_data = await trace_pool.trace(req.code, req.inputs, **options)
+    record_trace_timings(trace_data)
+    trace_data["range"] = [req.start, req.stop]
+    return trace_response(trace_data, request)
+
+# -----------------------------------------------------
+# Value Endpoint (expands truncated values on demand)
+# -----------------------------------------------------
+@app.post("/python/value")
+async def value_py(req: ValueRequest) -> Dict[str, Any]:
+    if not req.path:
+        raise HTTPException(status_code=422, detail="path must start with a variable name")
+    return await trace_pool.run(
+        inspect_value, req.code, req.inputs, req.step, req.path,
+        req.offset, max(1, min(req.limit, 1000)), req.snapshot_limits, req.trace_limits,
+        req.trace_functions, req.skip_functions, req.step_over_calls,
+    )
+
+# -----------------------------------------------------
+# Algorithm Endpoints (run in the worker pool)
+# -----------------------------------------------------
+async def run_algorithm_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return await trace_pool.run(run_algorithm, job)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/python/bfs")
+async def bfs_py(req: GraphRequest) -> Dict[str, Any]:
+    return await run_algorithm_job({"algorithm": "bfs", **req.model_dump()})
+
+@app.post("/python/dfs")
+async def dfs_py(req: GraphRequest) -> Dict[str, Any]:
+    return await run_algorithm_job({"algorithm": "dfs", **req.model_dump()})
+
+@app.post("/python/wavearray")
+async def wavearray_py(req: WaveArrayRequest) -> Dict[str, Any]:
+    return await run_algorithm_job({"algorithm": "wavearray", "numbers": req.numbers})
+
+@app.post("/python/algorithms/batch")
+async def algorithms_batch_py(req: AlgorithmBatchRequest) -> Dict[str, Any]:
+    """
+    Run many algorithm jobs at once, spread over the worker processes.
+    Results come back in job order; a failed job has an "error" entry.
+    """
+    if len(req.jobs) > ALGORITHM_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"At most {ALGORITHM_BATCH_MAX} jobs per batch")
+    jobs = [job.model_dump() for job in req.jobs]
+    # One chunk per worker (round-robin, so big and small jobs mix)
+    chunks = max(1, min(len(jobs), trace_pool.workers))
+    chunk_results = await asyncio.gather(*[
+        trace_pool.run(run_algorithm_batch, jobs[i::chunks]) for i in range(chunks)
+    ])
+    results = [None] * len(jobs)
+    for i, chunk in enumerate(chunk_results):
+        results[i::chunks] = chunk
+    return {"results": results}
+
+# -----------------------------------------------------
+# Variable Map Endpoint (fetched lazily by the frontend)
+# -----------------------------------------------------
+@app.post("/python/variable-map")
+async def variable_map_py(req: VariableMapRequest) -> Dict[str, Any]:
+    var_names = req.variables if req.variables is not None else predict_variable_names(req.code)
+    return {"variable_map": await build_variable_map(req.code, var_names)}
 
 # -----------------------------------------------------
 # NEW — Explain Endpoint
 # -----------------------------------------------------
+def _stored_step(trace_id: str, step: int) -> Dict[str, Any]:
+    steps = trace_store.window(trace_id, step, step)
+    if steps is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired trace_id")
+    if not steps or step < 0:
+        raise HTTPException(status_code=422, detail=f"Trace has no step {step}")
+    return steps[0]
+
+def _ai_stream_response(pieces, field: str, request: Request) -> StreamingResponse:
+    """
+    Stream an AI answer: "delta" events with each new piece of text, then a
+    "done" event carrying the whole answer under `field`.
+    NDJSON by default, Server-Sent Events when the client accepts text/event-stream.
+    """
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def events():
+        text = []
+        async for piece in pieces:
+            text.append(piece)
+            yield _format_event({"type": "delta", "text": piece}, sse)
+        yield _format_event({"type": "done", field: "".join(text).strip()}, sse)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
 @app.post("/python/explain")
-async def explain_py(req: ExplainCodeRequest) -> Dict[str, str]:
-    explanation = await get_ai_explanation(req.code_line)
+async def explain_py(req: ExplainCodeRequest, request: Request):
+    code_line, code, line_number = req.code_line, req.code, req.line_number
+    if req.trace_id is not None:
+        line_number = _stored_step(req.trace_id, req.step or 0).get("line") or 0
+        code = trace_store.get(req.trace_id)["code"]
+    if code is not None and line_number is not None:
+        lines = code.splitlines()
+        if not 1 <= line_number <= len(lines):
+            raise HTTPException(status_code=422, detail="That step is not on a line of code")
+        code_line = lines[line_number - 1].strip()
+    if not code_line:
+        raise HTTPException(status_code=422, detail="Provide code_line, code and line_number, or trace_id and step")
+
+    if code is not None and line_number is not None:
+        explanation = cached_line_explanation(code, line_number)
+        if explanation is None and req.stream:
+            # Stream this line now; explain the rest of the program meanwhile
+            warm_line_cache(code)
+        elif explanation is None:
+            explanation = (await explain_program(code)).get(line_number)
+        if explanation is not None:
+            if req.stream:
+                return _ai_stream_response(_replay([explanation]), "explanation", request)
+            return {"explanation": explanation}
+
+    if req.stream:
+        return _ai_stream_response(stream_ai_explanation(code_line), "explanation", request)
+    explanation = await get_ai_explanation(code_line)
     return {"explanation": explanation}
 
+@app.post("/python/explain/batch")
+async def explain_batch_py(req: ExplainBatchRequest) -> Dict[str, Any]:
+    """
+    Explain every line of a program in one model call: {"explanations":
+    {line number: text}}. Lines the model left out are missing; /python/explain
+    still answers those one by one.
+    """
+    code = req.code
+    if req.trace_id is not None:
+        entry = trace_store.get(req.trace_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired trace_id")
+        code = entry["code"]
+    if not code:
+        raise HTTPException(status_code=422, detail="Provide code, or trace_id")
+    return {"explanations": await explain_program(code)}
+
 # -----------------------------------------------------
 # NEW — Summary Endpoint
 # -----------------------------------------------------
 @app.post("/python/summarize")
-async def summarize_py(req: SummarizeCodeRequest) -> Dict[str, str]:
-    if not req.trace:
+async def summarize_py(req: SummarizeCodeRequest, request: Request):
+    code = req.code
+    if req.trace_id is not None:
+        entry = trace_store.get(req.trace_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired trace_id")
+        code = entry["code"]
+        final_step = _stored_step(req.trace_id, len(entry["steps"]) - 1) if entry["steps"] else None
+        if final_step is not None:
+            # Stored steps only carry their own output chunk
+            final_step = {**final_step, "output": entry["final_output"], "error": entry["error"]}
+    else:
+        final_step = req.trace[-1] if req.trace else None
+    if code is None:
+        raise HTTPException(status_code=422, detail="Provide code and trace, or trace_id")
+    if final_step is None:
         return {"summary": "Execution trace is empty, cannot generate summary."}
 
-    final_step = req.trace[-1]
-    summary = await get_ai_summary(req.code, final_step)
+    if req.stream:
+        return _ai_stream_response(stream_ai_summary(code, final_step), "summary", request)
+    summary = await get_ai_summary(code, final_step)
     return {"summary": summary}
 
 # -----------------------------------------------------
 # ❤️ LEGACY ENDPOINTS (Required for your frontend)
 # -----------------------------------------------------
 @app.post("/visualize")
-async def visualize_alias(req: CodeExecutionRequest):
-    return await visualize_py(req)
+async def visualize_alias(req: CodeExecutionRequest, request: Request):
+    return await visualize_py(req, request)
 
 @app.post("/explain")
-async def explain_alias(req: ExplainCodeRequest):
-    return await explain_py(req)
+async def explain_alias(req: ExplainCodeRequest, request: Request):
+    return await explain_py(req, request)
 
 @app.post("/summarize")
-async def summarize_alias(req: SummarizeCodeRequest):
-    return await summarize_py(req)
+async def summarize_alias(req: SummarizeCodeRequest, request: Request):
+    return await summarize_py(req, request)
+
+# -----------------------------------------------------
+# Trace cache stats
+# -----------------------------------------------------
+@app.get("/python/cache/stats")
+def cache_stats() -> Dict[str, Any]:
+    return {
+        **trace_cache.stats(),
+        "ai": dict(ai_stats),
+        "store": trace_store.stats(),
+        "sessions": trace_sessions.stats(),
+    }
+
+# -----------------------------------------------------
+# Metrics (Prometheus text format) and slow-request profiles
+# -----------------------------------------------------
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    cache = trace_cache.stats()
+    store = trace_store.stats()
+    sessions = trace_sessions.stats()
+    gauges = {
+        "trace_cache_entries": ("Traces held in the memory cache.", cache["entries"]),
+        "trace_cache_bytes": ("Size of the memory cache.", cache["bytes"]),
+        "trace_cache_hits": ("Trace cache hits (memory and disk) since start.", cache["hits"] + cache["disk_hits"]),
+        "trace_cache_misses": ("Trace cache misses since start.", cache["misses"]),
+        "trace_store_traces": ("Traces held for windowed access.", store["traces"]),
+        "trace_store_bytes": ("Size of the trace store.", store["bytes"]),
+        "trace_sessions": ("Sessions remembered for incremental re-tracing.", sessions["sessions"]),
+        "trace_sessions_reused_steps": ("Steps reused by incremental re-tracing since start.", sessions["reused_steps"]),
+        "trace_pool_pending": ("Jobs queued or running in the tracing workers.", trace_pool.pending),
+        "ai_upstream_calls": ("Calls made to the AI service since start.", ai_stats["upstream_calls"]),
+        "ai_cache_hits": ("AI answers served from the response cache since start.", ai_stats["cache_hits"]),
+        "ai_coalesced": ("AI requests that shared an in-flight call since start.", ai_stats["coalesced"]),
+        "ai_line_cache_hits": ("Line explanations served from the per-line cache since start.", ai_stats["line_cache_hits"]),
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles")
+def metrics_profiles() -> List[Dict[str, Any]]:
+    """The slowest sampled requests (PROFILE_SAMPLE_RATE), slowest first."""
+    return slow_profiles()
 
 # -----------------------------------------------------
 # Health check
@@ -0,0 +1,208 @@
+import contextvars
+import heapq
+import math
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Optional: pyinstrument provides the sampling profiler for slow requests
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# --- Slow-request profiling (off unless PROFILE_SAMPLE_RATE > 0) ---
+# PROFILE_SAMPLE_RATE: share of requests run under the sampling profiler
+# PROFILE_SLOW_MS: sampled requests slower than this keep their profile
+# PROFILE_KEEP: how many of the slowest profiles are kept
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "10"))
+
+METRIC_PREFIX = "studymate_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STEP_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, values)} {_number(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.labels = labels
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, values)} {count}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("route", "method", "status"))
+http_latency = Histogram("http_request_seconds", "Request duration, until the response is complete.", LATENCY_BUCKETS, ("route",))
+phase_latency = Histogram("phase_seconds", "Time spent per request phase.", LATENCY_BUCKETS, ("phase",))
+trace_step_counts = Histogram("trace_steps", "Steps per trace returned.", STEP_BUCKETS)
+trace_response_bytes = Histogram("trace_response_bytes", "Encoded size of trace responses.", BYTE_BUCKETS)
+ai_latency = Histogram("ai_call_seconds", "Upstream AI call latency.", LATENCY_BUCKETS, ("kind",))
+ai_errors = Counter("ai_errors_total", "Failed upstream AI calls.", ("kind",))
+
+REGISTRY = [http_requests, http_latency, phase_latency, trace_step_counts, trace_response_bytes, ai_latency, ai_errors]
+
+
+def render_metrics(gauges: Dict[str, Tuple[str, float]]) -> str:
+    """Prometheus text format: the registry plus point-in-time gauges {name: (help, value)}."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, (help_text, value) in gauges.items():
+        full_name = METRIC_PREFIX + name
+        lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} gauge", f"{full_name} {_number(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-request phase timings (reported in the Server-Timing header) ---
+_request_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_phases", default=None)
+
+
+def record_phase(name: str, seconds: float):
+    """Add time to a phase of the current request (and to the phase histogram)."""
+    phase_latency.observe(seconds, name)
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def server_timing(phases: Dict[str, float], total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+# --- Slow-request profiles ---
+_slow_profiles: List[tuple] = []  # min-heap of (seconds, counter, entry)
+_profile_counter = 0
+
+
+def _keep_profile(seconds: float, route: str, profiler):
+    global _profile_counter
+    _profile_counter += 1
+    entry = {"route": route, "seconds": round(seconds, 4), "profile": profiler.output_text(unicode=False, color=False)}
+    item = (seconds, _profile_counter, entry)
+    if len(_slow_profiles) < PROFILE_KEEP:
+        heapq.heappush(_slow_profiles, item)
+    elif seconds > _slow_profiles[0][0]:
+        heapq.heapreplace(_slow_profiles, item)
+
+
+def slow_profiles() -> List[Dict[str, Any]]:
+    """The kept profiles, slowest first."""
+    return [entry for _, _, entry in sorted(_slow_profiles, reverse=True)]
+
+
+if PROFILE_SAMPLE_RATE > 0 and Profiler is None:
+    print("PROFILE_SAMPLE_RATE is set but pyinstrument is not installed; profiling is disabled.")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: times every HTTP request, counts it by route and
+    status, and adds a Server-Timing header listing the phases recorded
+    while it ran. Samples requests into the profiler when enabled.
+    Work done in the worker processes shows up in the phases (reported by
+    the tracer), not in the profiles, which cover this process only.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        phases: Dict[str, float] = {}
+        token = _request_phases.set(phases)
+        start = time.perf_counter()
+        status = ["500"]
+        profiler = None
+        if Profiler is not None and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+                header = server_timing(phases, time.perf_counter() - start)
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_phases.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(route, scope["method"], status[0])
+            http_latency.observe(elapsed, route)
+            if profiler is not None:
+                profiler.stop()
+                if elapsed * 1000 >= PROFILE_SLOW_MS:
+                    _keep_profile(elapsed, route, profiler)
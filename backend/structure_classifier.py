@@ -0,0 +1,262 @@
+import ast
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Labels understood by the frontend (same set the AI variable mapper uses)
+LABELS = ("graph", "stack", "queue", "binary_tree", "linked_list", "dictionary", "set", "heap", "other")
+
+# Variables classified below this confidence are sent to the AI mapper
+CLASSIFIER_CONFIDENCE = float(os.getenv("CLASSIFIER_CONFIDENCE", "0.7"))
+
+_HEAPQ_FUNCTIONS = {"heappush", "heappop", "heapify", "heappushpop", "heapreplace"}
+_LINKED_ATTRS = {"next", "prev"}
+_TREE_ATTRS = {"left", "right"}
+
+
+def _name_of(node) -> Optional[str]:
+    """Variable name behind `x`, `self.x` is ignored (only plain names are mapped)."""
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _call_name(call: ast.Call) -> Optional[str]:
+    """`deque` for both `deque(...)` and `collections.deque(...)`."""
+    func = call.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+class _UsageCollector(ast.NodeVisitor):
+    """Collects weighted evidence about how each variable is used."""
+
+    def __init__(self):
+        self.evidence = defaultdict(lambda: defaultdict(float))  # name -> label -> weight
+        self.methods = defaultdict(set)  # name -> methods called on it
+        self.class_attrs = defaultdict(set)  # class name -> attributes set on self
+        self.instances = defaultdict(set)  # name -> classes assigned to it
+
+    def add(self, name: Optional[str], label: str, weight: float):
+        if name:
+            self.evidence[name][label] += weight
+
+    # --- Definitions ---
+    def visit_ClassDef(self, node: ast.ClassDef):
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Attribute) and isinstance(sub.ctx, ast.Store):
+                if isinstance(sub.value, ast.Name) and sub.value.id == "self":
+                    self.class_attrs[node.name].add(sub.attr)
+        self.generic_visit(node)
+
+    def visit_Assign(self, node: ast.Assign):
+        for target in node.targets:
+            self._classify_value(_name_of(target), node.value)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign):
+        if node.value is not None:
+            self._classify_value(_name_of(node.target), node.value)
+        self.generic_visit(node)
+
+    def _classify_value(self, name: Optional[str], value):
+        if not name:
+            return
+        if isinstance(value, ast.Dict):
+            if value.values and all(isinstance(v, (ast.List, ast.Set, ast.Tuple)) for v in value.values):
+                self.add(name, "graph", 0.8)  # adjacency list literal
+            else:
+                self.add(name, "dictionary", 0.3)
+        elif isinstance(value, ast.DictComp) and isinstance(value.value, (ast.List, ast.ListComp)):
+            self.add(name, "graph", 0.6)
+        elif isinstance(value, (ast.Set, ast.SetComp)):
+            self.add(name, "set", 0.8)
+        elif isinstance(value, (ast.Constant, ast.BinOp, ast.Compare, ast.BoolOp, ast.JoinedStr)):
+            self.add(name, "other", 0.8)
+        elif isinstance(value, ast.Call):
+            called = _call_name(value)
+            if called == "deque":
+                self.add(name, "queue", 0.4)
+            elif called == "set" or called == "frozenset":
+                self.add(name, "set", 0.8)
+            elif called == "defaultdict":
+                if value.args and isinstance(value.args[0], ast.Name) and value.args[0].id in ("list", "set"):
+                    self.add(name, "graph", 0.7)
+                else:
+                    self.add(name, "dictionary", 0.3)
+            elif called == "dict":
+                self.add(name, "dictionary", 0.3)
+            elif called in ("PriorityQueue",):
+                self.add(name, "heap", 0.9)
+            elif called in ("Queue", "SimpleQueue"):
+                self.add(name, "queue", 0.9)
+            elif called in ("LifoQueue",):
+                self.add(name, "stack", 0.9)
+            elif called in ("len", "int", "float", "str", "sum", "min", "max", "abs", "input", "bool"):
+                self.add(name, "other", 0.8)
+            elif called:
+                self.instances[name].add(called)
+
+    # --- Usage ---
+    def visit_Call(self, node: ast.Call):
+        func = node.func
+        if isinstance(func, ast.Attribute):
+            owner = _name_of(func.value)
+            method = func.attr
+            if owner == "heapq" or method in _HEAPQ_FUNCTIONS:
+                if method in _HEAPQ_FUNCTIONS and node.args:
+                    self.add(_name_of(node.args[0]), "heap", 1.0)
+            elif owner:
+                self.methods[owner].add(method)
+                if method == "popleft":
+                    self.add(owner, "queue", 1.0)
+                elif method == "appendleft":
+                    self.add(owner, "queue", 0.3)
+                elif method == "pop":
+                    if node.args and isinstance(node.args[0], ast.Constant) and node.args[0].value == 0:
+                        self.add(owner, "queue", 1.0)
+                    elif not node.args or (
+                        isinstance(node.args[0], ast.UnaryOp) and isinstance(node.args[0].op, ast.USub)
+                    ):
+                        self.add(owner, "stack", 0.5)
+                elif method in ("add", "discard"):
+                    self.add(owner, "set", 0.6)
+                elif method in ("put", "get") and "PriorityQueue" in self.instances.get(owner, ()):
+                    self.add(owner, "heap", 0.5)
+            # graph[u].append(v) / graph[u].add(v)
+            if isinstance(func.value, ast.Subscript) and method in ("append", "add", "extend"):
+                self.add(_name_of(func.value.value), "graph", 0.6)
+        elif isinstance(func, ast.Name) and func.id in _HEAPQ_FUNCTIONS and node.args:
+            # from heapq import heappush
+            self.add(_name_of(node.args[0]), "heap", 1.0)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        owner = _name_of(node.value)
+        if owner and owner != "self":
+            if node.attr in _LINKED_ATTRS:
+                self.add(owner, "linked_list", 0.5)
+            elif node.attr in _TREE_ATTRS:
+                self.add(owner, "binary_tree", 0.5)
+        self.generic_visit(node)
+
+    def visit_For(self, node: ast.For):
+        # for i in range(n): -> plain counter
+        if isinstance(node.iter, ast.Call) and _call_name(node.iter) in ("range", "enumerate"):
+            targets = node.target.elts if isinstance(node.target, ast.Tuple) else [node.target]
+            for target in targets:
+                self.add(_name_of(target), "other", 0.8)
+        # for v in graph[u]: -> adjacency lookup
+        if isinstance(node.iter, ast.Subscript):
+            self.add(_name_of(node.iter.value), "graph", 0.5)
+        elif isinstance(node.iter, ast.Call) and _call_name(node.iter) == "get":
+            func = node.iter.func
+            if isinstance(func, ast.Attribute):
+                self.add(_name_of(func.value), "graph", 0.5)
+        self.generic_visit(node)
+
+
+def predict_variable_names(code: str) -> List[str]:
+    """
+    Names the trace is likely to show, known before running the code:
+    everything assigned or bound as a parameter, minus dunders.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names[node.id] = None
+        elif isinstance(node, ast.arg):
+            names[node.arg] = None
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names[node.name] = None
+    return [name for name in names if not name.startswith("__")]
+
+
+def ambiguous_variable_names(code: str) -> List[str]:
+    """
+    Predicted names the code alone can't label confidently but has some
+    evidence for. Names without any evidence are mostly loop variables and
+    popped items, which their final values label as scalars after the run.
+    """
+    names = predict_variable_names(code)
+    local = classify_variables(code, names)
+    return [name for name in names if 0 < local[name]["confidence"] < CLASSIFIER_CONFIDENCE]
+
+
+def _class_label(attrs: set) -> Optional[str]:
+    if attrs & _TREE_ATTRS:
+        return "binary_tree"
+    if attrs & _LINKED_ATTRS:
+        return "linked_list"
+    return None
+
+
+def _value_label(value: Any) -> Optional[str]:
+    """Label implied by a serialized final value, when it is unambiguous."""
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return "other"
+    return None
+
+
+def classify_variables(code: str, var_names: List[str], values: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Infer a data-structure label for each variable from how the code uses it.
+    Returns {name: {"type": label, "confidence": 0..1}}.
+    `values` (serialized final values) lets plain scalars be labelled directly.
+    """
+    values = values or {}
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return {name: {"type": "other", "confidence": 0.0} for name in var_names}
+
+    collector = _UsageCollector()
+    collector.visit(tree)
+
+    # An append+pop() pair is the usual stack idiom; a list that is only ever
+    # added to is just a plain collection
+    for name, methods in collector.methods.items():
+        if "append" in methods and "pop" in methods:
+            collector.add(name, "stack", 0.4)
+        elif methods and methods <= {"append", "extend", "sort", "reverse", "index", "count"}:
+            collector.add(name, "other", 0.7)
+
+    # Instances of node-like classes (self.next / self.left ...)
+    for name, classes in collector.instances.items():
+        for class_name in classes:
+            label = _class_label(collector.class_attrs.get(class_name, set()))
+            if label:
+                collector.add(name, label, 0.8)
+
+    result = {}
+    for name in var_names:
+        value = values.get(name, [])
+        if _value_label(value) == "other":
+            result[name] = {"type": "other", "confidence": 1.0}
+            continue
+        if isinstance(value, dict) and value and not value.keys() & {"__type__", "__ref__", "__unwatched__"}:
+            # A mapping to plain values is a dictionary, to lists an adjacency
+            # list. Lists of node ids outweigh a `{}` literal, which is how
+            # adjacency lists built step by step start out.
+            if all(isinstance(v, list) for v in value.values()):
+                node_ids = all(_value_label(item) == "other" for v in value.values() for item in v)
+                collector.add(name, "graph", 1.0 if node_ids else 0.4)
+            elif not any(isinstance(v, (list, dict)) for v in value.values()):
+                collector.add(name, "dictionary", 0.6)
+
+        scores = collector.evidence.get(name)
+        if not scores:
+            result[name] = {"type": "other", "confidence": 0.0}
+            continue
+
+        label, best = max(scores.items(), key=lambda item: item[1])
+        total = sum(scores.values())
+        # Strong evidence that isn't contradicted by other labels -> high confidence
+        confidence = min(1.0, best) * (best / total)
+        result[name] = {"type": label, "confidence": round(confidence, 3)}
+    return result
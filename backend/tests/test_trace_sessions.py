@@ -0,0 +1,48 @@
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.trace_sessions import changed_lines, reusable_prefix, trace_sessions
+from backend.tracer import trace_python_code
+
+BUBBLE_SORT = """arr = [5, 2, 4, 1]
+n = len(arr)
+for i in range(n):
+    for j in range(n - i - 1):
+        if arr[j] > arr[j + 1]:
+            arr[j], arr[j + 1] = arr[j + 1], arr[j]
+print(arr)
+"""
+TAIL_EDIT = BUBBLE_SORT.replace("print(arr)", "print(arr[::-1])")
+
+
+def test_line_edited_in_place_is_not_an_insertion():
+    changed, line_map = changed_lines(BUBBLE_SORT, TAIL_EDIT)
+    assert changed == {7}
+    assert line_map[6] == 6
+
+
+def test_growing_replacement_marks_enclosing_blocks():
+    # Two lines in place of one: the extra one may run right after the loops
+    edited = BUBBLE_SORT.replace("print(arr)", "total = sum(arr)\nprint(total)")
+    changed, _ = changed_lines(BUBBLE_SORT, edited)
+    assert changed == {3, 4, 5, 6, 7}
+
+
+def test_tail_edit_reuses_every_step_before_it():
+    steps = trace_python_code(BUBBLE_SORT, [])["steps"]
+    prefix, lines = reusable_prefix(BUBBLE_SORT, TAIL_EDIT, steps)
+    first_print = next(i for i, step in enumerate(steps) if step.get("line") == 7)
+    assert len(prefix) == first_print
+    assert lines == [step["line"] for step in steps[:first_print]]
+
+
+def test_tail_edit_resubmission_counts_reused_steps():
+    with TestClient(app) as client:
+        first = client.post("/python/visualize", json={"code": BUBBLE_SORT, "session_id": "tail-edit"}).json()
+        reused_before = trace_sessions.reused_steps
+        second = client.post("/python/visualize", json={"code": TAIL_EDIT, "session_id": "tail-edit"}).json()
+
+    first_print = next(i for i, step in enumerate(first["steps"]) if step.get("line") == 7)
+    assert trace_sessions.reused_steps - reused_before == first_print
+    assert len(second["steps"]) == len(first["steps"])
+    assert second["final_output"] == "[5, 4, 2, 1]\n"
@@ -0,0 +1,105 @@
+import json
+import re
+import sys
+
+import pytest
+
+from backend.tracer import (
+    BACKEND_MONITORING, BACKEND_SETTRACE, SNAPSHOT_HEAP, TRACE_FORMAT_V1, TRACE_FORMAT_V2,
+    decode_trace_steps, trace_python_code,
+)
+from benchmarks.corpus import PROGRAMS
+
+CORPUS = {
+    **PROGRAMS,
+    "caught_exception": """def parse(text):
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+values = [parse(t) for t in ["1", "x", "3"]]
+total = sum(v for v in values if v is not None)
+""",
+    "uncaught_exception": """def divide(a, b):
+    return a / b
+
+result = divide(4, 2)
+result = divide(1, 0)
+""",
+    "raise_in_callee": """def check(n):
+    if n > 2:
+        raise ValueError(n)
+    return n
+
+seen = []
+try:
+    for i in range(5):
+        seen.append(check(i))
+except ValueError as e:
+    error = str(e)
+""",
+    "generator": """def evens(limit):
+    for n in range(limit):
+        if n % 2 == 0:
+            yield n
+
+squares = [n * n for n in evens(7)]
+""",
+}
+
+FOCUS_OPTIONS = [
+    {},
+    {"step_over_calls": True},
+    {"skip_functions": ["check", "merge_sort"]},
+]
+
+CAPS = {"max_length": 3, "max_depth": 2, "max_nodes": 20}
+
+
+def _run(code: str, **options) -> dict:
+    """The trace without its timings, and with object addresses in reprs blanked out."""
+    trace = trace_python_code(code, [], **options)
+    trace.pop("timings", None)
+    return json.loads(re.sub(r" at 0x[0-9a-f]+", " at 0x0", json.dumps(trace)))
+
+
+@pytest.mark.skipif(not hasattr(sys, "monitoring"), reason="sys.monitoring needs Python 3.12+")
+@pytest.mark.parametrize("options", FOCUS_OPTIONS, ids=["lines", "step_over", "skip"])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_backends_produce_the_same_trace(name, options):
+    settrace = _run(CORPUS[name], backend=BACKEND_SETTRACE, **options)
+    monitoring = _run(CORPUS[name], backend=BACKEND_MONITORING, **options)
+    assert monitoring == settrace
+
+
+@pytest.mark.parametrize("snapshot_limits", [{}, CAPS], ids=["defaults", "small"])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_v2_decodes_to_v1(name, snapshot_limits):
+    # v2 is always capped, so compare against a v1 trace under the same caps
+    v1 = _run(CORPUS[name], trace_format=TRACE_FORMAT_V1, snapshot_limits=snapshot_limits)
+    v2 = _run(CORPUS[name], trace_format=TRACE_FORMAT_V2, snapshot_limits=snapshot_limits, keyframe_interval=4)
+    assert list(decode_trace_steps(v2["steps"])) == v1["steps"]
+    assert v2["steps"][-1]["keyframe"]
+
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_v2_heap_mode_decodes_to_v1(name):
+    v1 = _run(CORPUS[name], trace_format=TRACE_FORMAT_V1, snapshot_mode=SNAPSHOT_HEAP)
+    v2 = _run(CORPUS[name], trace_format=TRACE_FORMAT_V2, snapshot_mode=SNAPSHOT_HEAP, keyframe_interval=4)
+    assert list(decode_trace_steps(v2["steps"])) == v1["steps"]
+
+
+def test_snapshot_caps_are_applied():
+    code = "items = list(range(10))\nnested = [[[[1]]]]\n"
+    steps = _run(code, snapshot_limits=CAPS)["steps"]
+    final = steps[-1]["variables"]
+    assert final["items"]["__truncated__"] == {"length": 10, "path": ["items"]}
+    assert final["items"]["items"] == [0, 1, 2]
+    assert final["nested"][0][0][0]["__truncated__"]["path"] == ["nested", 0, 0, 0]
+
+
+def test_v1_is_uncapped_without_snapshot_limits():
+    code = "items = list(range(500))\n"
+    final = _run(code)["steps"][-1]["variables"]
+    assert final["items"] == list(range(500))
@@ -0,0 +1,158 @@
+import ast
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# --- Cache configuration (per deployment) ---
+# TRACE_CACHE_MAX_BYTES: size budget of the in-memory tier (JSON bytes)
+# TRACE_CACHE_DIR: optional directory for an on-disk tier that survives restarts
+TRACE_CACHE_MAX_BYTES = int(os.getenv("TRACE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TRACE_CACHE_DIR = os.getenv("TRACE_CACHE_DIR")
+
+# Programs importing these can behave differently on every run, so their
+# traces are never cached.
+NONDETERMINISTIC_MODULES = {"random", "time", "datetime", "secrets", "uuid", "os", "sys", "threading"}
+
+
+def _parse(code: str) -> Optional[ast.Module]:
+    try:
+        return ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1024)  # Repeat submissions skip the parse entirely
+def normalize_source(code: str) -> str:
+    """
+    Canonical form of the source for cache keys.
+    The AST (with positions) ignores comments and whitespace-only edits but
+    keeps line numbers, which the trace depends on. Unparsable code falls
+    back to the text with normalized line endings.
+    """
+    tree = _parse(code)
+    if tree is None:
+        return code.replace("\r\n", "\n").rstrip()
+    return ast.dump(tree, include_attributes=True)
+
+
+@lru_cache(maxsize=1024)
+def is_cacheable(code: str) -> bool:
+    """True unless the code imports a module that makes runs nondeterministic."""
+    tree = _parse(code)
+    if tree is None:
+        return True  # A syntax error is reported the same way every time
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        else:
+            continue
+        if any(name.split(".")[0] in NONDETERMINISTIC_MODULES for name in names):
+            return False
+    return True
+
+
+def trace_cache_key(code: str, inputs: List[str], options: Dict[str, Any]) -> str:
+    payload = json.dumps([normalize_source(code), list(inputs), options], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TraceCache:
+    """
+    Content-addressed cache of trace results.
+
+    Tier 1 is an in-memory LRU bounded by the JSON size of its entries.
+    Tier 2 (optional) keeps one JSON file per key on disk; hits there are
+    promoted back into memory.
+    """
+
+    def __init__(self, max_bytes: int = TRACE_CACHE_MAX_BYTES, disk_dir: Optional[str] = TRACE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()  # key -> (size, trace_data)
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a shallow copy of the cached trace (callers may add top-level keys)."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                raw = path.read_text(encoding="utf-8")
+            except OSError:
+                raw = None
+            if raw is not None:
+                data = json.loads(raw)
+                self._remember(key, data, len(raw))
+                self.disk_hits += 1
+                return dict(data)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, data: Dict[str, Any]):
+        """Cache a shallow copy of `data`, so the caller may go on adding top-level keys."""
+        data = dict(data)
+        raw = json.dumps(data)
+        self._remember(key, data, len(raw))
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_text(raw, encoding="utf-8")
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Trace cache disk write failed: {e}")
+
+    def _remember(self, key: str, data: Dict[str, Any], size: int):
+        if size > self.max_bytes:
+            return  # Would evict everything else; keep it on disk only
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[0]
+        self._entries[key] = (size, data)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_enabled": self.disk_dir is not None,
+        }
+
+
+# Shared cache used by the API
+trace_cache = TraceCache()
@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from backend.metrics import phase, trace_response_bytes
+
+# Optional encoders: MessagePack and Brotli are offered only when installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- Media types ---
+# application/json                                   the plain trace (default)
+# application/vnd.studymate.trace.columnar+json      columnar layout (see to_columnar)
+# application/msgpack                                the plain trace as MessagePack
+# application/vnd.studymate.trace.columnar+msgpack   columnar layout as MessagePack
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.studymate.trace.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+COLUMNAR_MSGPACK_MEDIA_TYPE = "application/vnd.studymate.trace.columnar+msgpack"
+_MEDIA_ALIASES = {"application/x-msgpack": MSGPACK_MEDIA_TYPE}
+
+# --- Compression ---
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Step fields holding {name: value} maps, and lists of names
+_NAME_MAPS = ("variables", "changed", "heap", "heap_changed")
+_NAME_LISTS = ("deleted", "heap_deleted")
+
+
+def to_columnar(trace_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Columnar form of a trace: one list per step field instead of one dict
+    per step, with variable names and event names interned in "strings".
+    Maps become flat [name_id, value, name_id, value, ...] lists and name
+    lists become lists of ids; steps lacking a field hold null.
+    Other top-level fields are copied unchanged.
+    """
+    steps = trace_data.get("steps", [])
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+
+    def intern(name: str) -> int:
+        string_id = string_ids.get(name)
+        if string_id is None:
+            string_id = string_ids[name] = len(strings)
+            strings.append(name)
+        return string_id
+
+    columns: Dict[str, list] = {}
+    for index, step in enumerate(steps):
+        for key, value in step.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * len(steps)
+            if key in _NAME_MAPS:
+                flat = []
+                for name, item in value.items():
+                    flat.append(intern(name))
+                    flat.append(item)
+                column[index] = flat
+            elif key in _NAME_LISTS:
+                column[index] = [intern(name) for name in value]
+            elif key == "event":
+                column[index] = intern(value)
+            else:
+                column[index] = value
+
+    columnar = {k: v for k, v in trace_data.items() if k != "steps"}
+    columnar.update({"layout": "columnar", "length": len(steps), "strings": strings, "columns": columns})
+    return columnar
+
+
+def _parse_header(value: Optional[str]) -> List[Tuple[str, float]]:
+    """[(token, q), ...] of an Accept / Accept-Encoding header."""
+    parsed = []
+    for part in (value or "").split(","):
+        token, *params = [item.strip() for item in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        parsed.append((token.lower(), q))
+    return parsed
+
+
+def choose_media_type(accept: Optional[str]) -> str:
+    """Best supported media type for an Accept header (JSON when nothing better fits)."""
+    available = [JSON_MEDIA_TYPE, COLUMNAR_JSON_MEDIA_TYPE]
+    if msgpack is not None:
+        available += [MSGPACK_MEDIA_TYPE, COLUMNAR_MSGPACK_MEDIA_TYPE]
+
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for token, q in _parse_header(accept):
+        token = _MEDIA_ALIASES.get(token, token)
+        # Only an explicit request picks a non-JSON type, never */*
+        if token in available and q > best_q:
+            best, best_q = token, q
+    return best
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """"br" or "gzip" if the client accepts it, else None."""
+    accepted = {token: q for token, q in _parse_header(accept_encoding) if q > 0}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encode_body(data: Dict[str, Any], media_type: str) -> bytes:
+    if media_type in (COLUMNAR_JSON_MEDIA_TYPE, COLUMNAR_MSGPACK_MEDIA_TYPE):
+        data = to_columnar(data)
+    if media_type in (MSGPACK_MEDIA_TYPE, COLUMNAR_MSGPACK_MEDIA_TYPE):
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+
+
+def trace_response(data: Dict[str, Any], request: Request, status_code: int = 200) -> Response:
+    """
+    Serialize a trace response in the format the client asked for.
+    Also skips FastAPI's generic encoder, which is slow on large traces.
+    """
+    media_type = choose_media_type(request.headers.get("accept"))
+    with phase("encode"):
+        body, encoding = compress(
+            encode_body(data, media_type), choose_encoding(request.headers.get("accept-encoding"))
+        )
+    trace_response_bytes.observe(len(body))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
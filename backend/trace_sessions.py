@@ -0,0 +1,175 @@
+import ast
+import difflib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from backend.tracer import TRACE_FORMAT_V2, TraceDeltaEncoder, decode_trace_steps
+
+# --- Session configuration (per deployment) ---
+# TRACE_SESSIONS_MAX: sessions whose last trace is remembered
+# TRACE_SESSION_MAX_STEPS: steps remembered across all sessions
+# TRACE_SESSION_TTL: seconds a session's trace is kept after its last use
+TRACE_SESSIONS_MAX = int(os.getenv("TRACE_SESSIONS_MAX", "256"))
+TRACE_SESSION_MAX_STEPS = int(os.getenv("TRACE_SESSION_MAX_STEPS", "200000"))
+TRACE_SESSION_TTL = float(os.getenv("TRACE_SESSION_TTL", "1800"))
+
+
+def _statement_spans(tree: ast.Module) -> List[Tuple[int, int, int]]:
+    """
+    (first line, last header line, last line) of every statement.
+    Line events fire on header lines, so a change anywhere in a header
+    (decorators and continuation lines included) counts as a change to it.
+    """
+    spans = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.stmt, ast.ExceptHandler)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        body = getattr(node, "body", None)
+        header_end = max(node.lineno, body[0].lineno - 1) if body else node.end_lineno
+        spans.append((start, header_end, node.end_lineno))
+    return spans
+
+
+def changed_lines(old_code: str, new_code: str) -> Optional[Tuple[Set[int], Dict[int, int]]]:
+    """
+    Lines of the old code whose first execution may behave differently in
+    the new code, and the old -> new numbering of the unchanged lines.
+    None when either version doesn't parse.
+    """
+    try:
+        spans = _statement_spans(ast.parse(old_code))
+        ast.parse(new_code)
+    except (SyntaxError, ValueError):
+        return None
+
+    old_lines = old_code.splitlines()
+    new_lines = new_code.splitlines()
+    touched = set()   # Old lines that were edited or deleted
+    inserted = set()  # Old lines right before inserted code (0 = top of file)
+    line_map = {}
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                line_map[i1 + offset + 1] = j1 + offset + 1
+            continue
+        touched.update(range(i1 + 1, i2 + 1))
+        # A line edited in place is only touched; a replacement that grows
+        # also inserts code (control flow it changes is caught at run time
+        # by the fast-forward line check)
+        if tag == "insert" or (tag == "replace" and j2 - j1 > i2 - i1):
+            inserted.add(i1)
+
+    changed = set()
+    for start, header_end, end in spans:
+        header = range(start, header_end + 1)
+        if any(line in touched for line in header):
+            changed.update(header)
+        # Inserted code runs after the line before it, and possibly right
+        # after any block around that line (e.g. new code after a function)
+        if any(start <= line <= end for line in inserted):
+            changed.update(header)
+    if 0 in inserted:
+        changed.add(0)
+    return changed, line_map
+
+
+def reusable_prefix(old_code: str, new_code: str, old_steps: List[dict]) -> Tuple[List[dict], List[int]]:
+    """
+    The leading steps of the old trace that the new code reproduces exactly:
+    every step before the first execution of a changed line, renumbered to
+    the new code. Returns (steps, their new line numbers); empty when
+    nothing can be reused.
+    """
+    diff = changed_lines(old_code, new_code)
+    if diff is None:
+        return [], []
+    changed, line_map = diff
+    if 0 in changed:
+        return [], []  # Code added at the very top runs first
+
+    prefix, lines = [], []
+    for step in old_steps:
+        line = step.get("line")
+        if step.get("event") != "line" or line in changed or line not in line_map:
+            break
+        prefix.append({**step, "line": line_map[line]} if line_map[line] != line else step)
+        lines.append(line_map[line])
+    return prefix, lines
+
+
+def splice_steps(prefix: List[dict], rest: List[dict], trace_format: int, keyframe_interval: int) -> List[dict]:
+    """
+    Reused prefix + freshly traced rest as one trace. v2 steps are re-encoded
+    so keyframes fall where a full run would put them.
+    """
+    if trace_format != TRACE_FORMAT_V2:
+        return prefix + rest
+    encoder = TraceDeltaEncoder(keyframe_interval)
+    steps = [encoder.encode(step) for step in decode_trace_steps(prefix + rest)]
+    if steps:
+        steps[-1] = encoder.force_keyframe(steps[-1])
+    return steps
+
+
+class TraceSessions:
+    """
+    The last trace of each editing session, so a resubmission can reuse
+    the part of it the edit can't have affected.
+    """
+
+    def __init__(self, max_sessions: int = TRACE_SESSIONS_MAX, max_steps: int = TRACE_SESSION_MAX_STEPS,
+                 ttl: float = TRACE_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.max_steps = max_steps
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> entry, least recently used first
+        self._steps = 0
+        self.reused_steps = 0
+        self.mismatches = 0
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            self._drop(session_id)
+            return None
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def remember(self, session_id: str, code: str, inputs: List[str], options: Dict[str, Any], trace_data: Dict[str, Any]):
+        if session_id in self._sessions:
+            self._drop(session_id)
+        steps = trace_data.get("steps", [])
+        if len(steps) > self.max_steps:
+            return
+        self._sessions[session_id] = {
+            "code": code,
+            "inputs": list(inputs),
+            "options": options,
+            "steps": steps,
+            "expires": time.monotonic() + self.ttl,
+        }
+        self._steps += len(steps)
+        while len(self._sessions) > self.max_sessions or self._steps > self.max_steps:
+            self._drop(next(iter(self._sessions)))
+
+    def _drop(self, session_id: str):
+        entry = self._sessions.pop(session_id)
+        self._steps -= len(entry["steps"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "steps": self._steps,
+            "reused_steps": self.reused_steps,
+            "mismatches": self.mismatches,
+        }
+
+
+# Shared session memory used by the API
+trace_sessions = TraceSessions()
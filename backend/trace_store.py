@@ -0,0 +1,138 @@
+import json
+import os
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from backend.tracer import TRACE_FORMAT_V1, DEFAULT_KEYFRAME_INTERVAL, TraceDeltaEncoder, decode_trace_steps
+
+# --- Store configuration (per deployment) ---
+# TRACE_STORE_MAX_BYTES: size budget for stored traces (JSON bytes, v2 encoded)
+# TRACE_STORE_TTL: seconds a trace is kept after it was last read
+# TRACE_WINDOW_LIMIT: most steps returned by one window request
+TRACE_STORE_MAX_BYTES = int(os.getenv("TRACE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+TRACE_STORE_TTL = float(os.getenv("TRACE_STORE_TTL", "3600"))
+TRACE_WINDOW_LIMIT = int(os.getenv("TRACE_WINDOW_LIMIT", "1000"))
+
+
+def _keyframe_gap(steps: List[dict]) -> int:
+    """Most state-carrying steps (line/finished) between two keyframes of a v2 trace."""
+    gap = longest = 0
+    for step in steps:
+        if step.get("keyframe"):
+            gap = 0
+        elif step.get("event") in ("line", "finished"):
+            gap += 1
+            longest = max(longest, gap)
+    return longest
+
+
+def _as_v2(trace_data: Dict[str, Any]) -> List[dict]:
+    """
+    The steps v2 encoded at the store's keyframe interval. v2 traces encoded
+    with a longer interval (it is the client's choice) are re-encoded, so
+    seeking never replays more than DEFAULT_KEYFRAME_INTERVAL steps.
+    """
+    steps = trace_data.get("steps", [])
+    if trace_data.get("format", TRACE_FORMAT_V1) != TRACE_FORMAT_V1:
+        if _keyframe_gap(steps) < DEFAULT_KEYFRAME_INTERVAL:
+            return steps
+        steps = list(decode_trace_steps(steps))
+    encoder = TraceDeltaEncoder(DEFAULT_KEYFRAME_INTERVAL)
+    encoded = [encoder.encode(step) for step in steps]
+    if encoded:
+        encoded[-1] = encoder.force_keyframe(encoded[-1])
+    return encoded
+
+
+class TraceStore:
+    """
+    Traces kept server-side under an ID so clients can fetch any window of
+    steps instead of downloading the whole trace.
+
+    Steps are stored v2 encoded (keyframes + deltas) with the positions of
+    the keyframes, so rebuilding step k replays at most one keyframe
+    interval rather than k steps.
+    """
+
+    def __init__(self, max_bytes: int = TRACE_STORE_MAX_BYTES, ttl: float = TRACE_STORE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # trace_id -> entry dict, least recently used first
+        self._bytes = 0
+        self.evictions = 0
+
+    def put(self, code: str, inputs: List[str], trace_data: Dict[str, Any]) -> str:
+        steps = _as_v2(trace_data)
+        keyframes = [i for i, step in enumerate(steps) if step.get("keyframe")]
+        if steps and keyframes[:1] != [0]:
+            keyframes.insert(0, 0)  # Decoding starts from an empty state
+
+        trace_id = uuid.uuid4().hex
+        size = len(json.dumps(steps))
+        self._entries[trace_id] = {
+            "code": code,
+            "inputs": list(inputs),
+            "steps": steps,
+            "keyframes": keyframes,
+            "error": trace_data.get("error"),
+            "final_output": trace_data.get("final_output", ""),
+            "limit_exceeded": trace_data.get("limit_exceeded"),
+            "size": size,
+            "expires": time.monotonic() + self.ttl,
+        }
+        self._bytes += size
+        self._purge()
+        return trace_id
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """The stored entry (steps included), or None if unknown or expired."""
+        self._purge()
+        entry = self._entries.get(trace_id)
+        if entry is None:
+            return None
+        self._entries.move_to_end(trace_id)
+        entry["expires"] = time.monotonic() + self.ttl
+        return entry
+
+    def window(self, trace_id: str, start: int, stop: int) -> Optional[List[dict]]:
+        """Full-state steps start..stop (inclusive, clamped), or None if unknown."""
+        entry = self.get(trace_id)
+        if entry is None:
+            return None
+        steps = entry["steps"]
+        start = max(0, start)
+        stop = min(stop, len(steps) - 1, start + TRACE_WINDOW_LIMIT - 1)
+        if stop < start:
+            return []
+
+        keyframe = entry["keyframes"][bisect_right(entry["keyframes"], start) - 1]
+        decoded = decode_trace_steps(steps[keyframe:stop + 1])
+        return [step for i, step in enumerate(decoded, start=keyframe) if i >= start]
+
+    def _purge(self):
+        """Drop expired entries, then the least recently used ones over budget."""
+        now = time.monotonic()
+        for trace_id in [tid for tid, entry in self._entries.items() if entry["expires"] < now]:
+            self._drop(trace_id)
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, trace_id: str):
+        entry = self._entries.pop(trace_id)
+        self._bytes -= entry["size"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "traces": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+# Shared store used by the API
+trace_store = TraceStore()
@@ -1,39 +1,312 @@
+import ast
+import builtins
+import os
+import signal
 import sys
+import threading
 import copy
+import inspect
 import io
+import json
+import time
 import types
-from typing import List
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from typing import List, Optional, Tuple
 from collections import deque # <-- 1. ADD THIS IMPORT
 
-def make_serializable(obj):
+# --- Trace formats ---
+# v1: every step carries the full `variables` dict.
+# v2: steps carry only what changed since the previous step, plus a full
+#     keyframe every `keyframe_interval` steps (and always on the last step).
+TRACE_FORMAT_V1 = 1
+TRACE_FORMAT_V2 = 2
+SUPPORTED_TRACE_FORMATS = (TRACE_FORMAT_V1, TRACE_FORMAT_V2)
+DEFAULT_KEYFRAME_INTERVAL = 50
+
+# Filename given to the user's compiled source, so the tracer can tell user
+# frames apart from helpers (stdlib, MockInput, the output capture, ...).
+USER_CODE_FILENAME = "<user_code>"
+
+# --- Tracing backends ---
+# "settrace": classic sys.settrace hook (any Python version).
+# "monitoring": PEP 669 sys.monitoring, LINE events enabled only on the user's
+#               code objects (Python 3.12+).
+# "auto": the faster of the available backends, measured once per process.
+BACKEND_SETTRACE = "settrace"
+BACKEND_MONITORING = "monitoring"
+BACKEND_AUTO = "auto"
+TRACE_BACKEND = os.getenv("TRACE_BACKEND", BACKEND_AUTO)
+_MONITORING_TOOL_NAME = "studymate-tracer"
+
+# --- Snapshot limits ---
+# Caps applied to variable snapshots so a step costs the same no matter
+# how much data the program holds. Anything cut off is replaced by a
+# truncation marker whose "path" can be paged in with inspect_value().
+# Opt-in for plain v1 traces (their consumers expect complete values):
+# applied with v2, heap mode, or when limits are passed explicitly.
+#   max_length: items shown per list/dict/set/object
+#   max_depth:  nesting levels below the variable itself
+#   max_nodes:  containers serialized per step (shared by all variables)
+DEFAULT_SNAPSHOT_LIMITS = {
+    "max_length": int(os.getenv("SNAPSHOT_MAX_LENGTH", "100")),
+    "max_depth": int(os.getenv("SNAPSHOT_MAX_DEPTH", "8")),
+    "max_nodes": int(os.getenv("SNAPSHOT_MAX_NODES", "2000")),
+}
+# Per-request overrides are clamped to these
+SNAPSHOT_LIMIT_CEILINGS = {
+    "max_length": int(os.getenv("SNAPSHOT_MAX_LENGTH_CEILING", "1000")),
+    "max_depth": int(os.getenv("SNAPSHOT_MAX_DEPTH_CEILING", "32")),
+    "max_nodes": int(os.getenv("SNAPSHOT_MAX_NODES_CEILING", "20000")),
+}
+
+
+# --- Execution limits ---
+# Checked by the tracing hook on every line event, so runaway programs
+# (`while True: ...`) end with a partial trace instead of exhausting the worker.
+#   max_steps:       steps of the trace (line steps, and call/return steps of
+#                    stepped-over functions). Lines that summarize_loops
+#                    collapses or that fall before a step_range don't count,
+#                    so that a long loop can be summarized; max_seconds is
+#                    what bounds those runs.
+#   max_seconds:     wall-clock time
+#   max_trace_bytes: JSON size of the steps produced (after v2 encoding),
+#                    estimated by _TraceSize
+DEFAULT_TRACE_LIMITS = {
+    "max_steps": int(os.getenv("TRACE_MAX_STEPS", "10000")),
+    "max_seconds": float(os.getenv("TRACE_MAX_SECONDS", "5")),
+    "max_trace_bytes": int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024))),
+}
+# Per-request overrides are clamped to these
+TRACE_LIMIT_CEILINGS = {
+    "max_steps": int(os.getenv("TRACE_MAX_STEPS_CEILING", "100000")),
+    "max_seconds": float(os.getenv("TRACE_MAX_SECONDS_CEILING", "30")),
+    "max_trace_bytes": int(os.getenv("TRACE_MAX_BYTES_CEILING", str(100 * 1024 * 1024))),
+}
+
+
+class TraceLimitExceeded(BaseException):
+    """
+    Raised from the tracing hook when a limit is hit.
+    A BaseException so a student's `except Exception:` can't swallow it; a
+    bare `except:` can, but then the next event raises it again (see
+    trace_python_code), so the run still ends.
+    """
+
+    def __init__(self, limit: str, value):
+        super().__init__(f"{limit} ({value}) exceeded")
+        self.limit = limit
+        self.value = value
+
+
+class _TraceSize:
+    """
+    Running estimate of the JSON size of the recorded steps. Only the first
+    step of each kind (event, keyframe or not) and every
+    SAMPLE_INTERVAL-th one after it are json.dumps'ed; the others count as
+    the latest measured size of their kind, which follows data that grows
+    during the run.
+    """
+
+    SAMPLE_INTERVAL = 16
+
+    def __init__(self):
+        self.bytes = 0
+        self._seen = {}    # kind -> steps recorded
+        self._latest = {}  # kind -> size of the latest measured step
+
+    def add(self, step: dict):
+        kind = (step.get("event"), "keyframe" in step)
+        seen = self._seen.get(kind, 0)
+        self._seen[kind] = seen + 1
+        if seen % self.SAMPLE_INTERVAL == 0:
+            self._latest[kind] = len(json.dumps(step, separators=(",", ":")))
+        self.bytes += self._latest[kind]
+
+
+# Once a run has to stop, the alarm fires this often until it has
+_ALARM_RETRY_INTERVAL = 0.05
+
+
+@contextmanager
+def _deadline_alarm(seconds: float, on_alarm):
+    """
+    Backstop for the time limit when no line events arrive (a one-line
+    `while True: pass` jumps to itself without one on some versions, and
+    the hook is gone once user code has caught an exception raised from it).
+    `on_alarm(frame)` runs in the signal handler; after the first time the
+    alarm keeps firing every _ALARM_RETRY_INTERVAL. Yields `rearm()`, which
+    starts that repeating right away (for the other limits).
+    Only possible in the main thread, which is where pool workers run jobs.
+    """
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "setitimer"):
+        yield lambda: None
+        return
+
+    def handler(signum, frame):
+        on_alarm(frame)
+
+    def rearm():
+        signal.setitimer(signal.ITIMER_REAL, _ALARM_RETRY_INTERVAL, _ALARM_RETRY_INTERVAL)
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    # A little later than the hook's own check, which stops more cleanly
+    signal.setitimer(signal.ITIMER_REAL, seconds + 0.25, _ALARM_RETRY_INTERVAL)
+    try:
+        yield rearm
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+# --- Snapshot modes ---
+# "tree": every variable is a self-contained nested value (default)
+# "heap": custom objects live once in a per-step object table ("heap"),
+#         referenced as {"__ref__": n}; shared and cyclic nodes stay intact
+SNAPSHOT_TREE = "tree"
+SNAPSHOT_HEAP = "heap"
+SNAPSHOT_MODES = (SNAPSHOT_TREE, SNAPSHOT_HEAP)
+
+
+def _resolve_limits(defaults: dict, ceilings: dict, overrides=None) -> dict:
+    """Deployment defaults, with per-request overrides clamped to the ceilings."""
+    limits = dict(defaults)
+    for key, value in (overrides or {}).items():
+        if key in limits and value is not None:
+            cast = type(defaults[key])
+            floor = 1 if cast is int else 0.01
+            limits[key] = max(floor, min(cast(value), ceilings[key]))
+    return limits
+
+
+def resolve_snapshot_limits(overrides=None) -> dict:
+    return _resolve_limits(DEFAULT_SNAPSHOT_LIMITS, SNAPSHOT_LIMIT_CEILINGS, overrides)
+
+
+def resolve_trace_limits(overrides=None) -> dict:
+    return _resolve_limits(DEFAULT_TRACE_LIMITS, TRACE_LIMIT_CEILINGS, overrides)
+
+
+_SCALAR_TYPES = (int, float, str, bool, type(None))
+_CONTAINER_TYPES = (list, tuple, deque, set, frozenset, dict)
+
+
+def _container_length(obj):
+    if isinstance(obj, _CONTAINER_TYPES):
+        return len(obj)
+    if hasattr(obj, '__dict__'):
+        return len(obj.__dict__)
+    return None
+
+
+def _set_order(obj, max_length=None):
+    """
+    Order in which a set's items are shown (and addressed by path).
+    Small sets are sorted for consistency; sets too big to show in full keep
+    their stored order, so a step never pays for sorting them.
+    """
+    if max_length is not None and len(obj) > max_length:
+        return obj
+    try:
+        return sorted(list(obj))
+    except:
+        # If items aren't comparable, just convert to list
+        return list(obj)
+
+
+class _HeapPath:
+    """
+    Leading element of a path inside a heap entry; stands for the path at
+    which the object was reached. Only expanded when a marker needs it, so
+    long chains of nodes don't copy ever-longer paths around.
+    """
+    __slots__ = ("home",)
+
+    def __init__(self, home):
+        self.home = home
+
+
+def _expand_path(path) -> list:
+    path = list(path)
+    while path and isinstance(path[0], _HeapPath):
+        path = list(path[0].home) + path[1:]
+    return path
+
+
+def _truncated(obj, path, items=None):
+    marker = {
+        "__type__": type(obj).__name__,
+        "__truncated__": {"length": _container_length(obj), "path": _expand_path(path)},
+    }
+    if items is not None:
+        marker["items"] = items
+    return marker
+
+
+def make_serializable(obj, limits=None, path=(), budget=None, on_object=None):
     """
     Recursively convert an object into a JSON-serializable format.
     Handles sets, deques, and custom classes.
+    With `limits` (see DEFAULT_SNAPSHOT_LIMITS), large or deep containers are
+    cut off and marked; `path` locates `obj` (variable name first) and
+    `budget` is the node count shared by one step's snapshot.
+    `on_object(obj, path)`, when given, replaces the serialization of custom
+    objects (used by HeapSnapshotter to emit references).
     """
     # 1. Basic Types
     if isinstance(obj, (int, float, str, bool, type(None))):
         return obj
-    
+
+    if on_object is not None and hasattr(obj, '__dict__') and not isinstance(obj, _CONTAINER_TYPES):
+        return on_object(obj, path)
+
+    max_length = None
+    if limits is not None:
+        if budget is None:
+            budget = [limits["max_nodes"]]
+        budget[0] -= 1
+        if budget[0] < 0 or len(path) - 1 > limits["max_depth"]:
+            return _truncated(obj, path)
+        max_length = limits["max_length"]
+
+    def child(value, key):
+        if limits is None:
+            return make_serializable(value)
+        return make_serializable(value, limits, path + (key,), budget, on_object)
+
+    def cut(items):
+        # Only the first `max_length` entries are serialized
+        return items if max_length is None else islice(items, max_length)
+
     # 2. Lists, Tuples, AND Deques (Convert all to list)
     if isinstance(obj, (list, tuple, deque)):
-        return [make_serializable(item) for item in obj]
+        items = [child(item, i) for i, item in enumerate(cut(obj))]
+        if max_length is not None and len(obj) > max_length:
+            return _truncated(obj, path, items)
+        return items
     
     # 3. Sets (Convert to list, sorted for consistency)
-    if isinstance(obj, set):
-        try:
-            return [make_serializable(item) for item in sorted(list(obj))]
-        except:
-            # If items aren't comparable, just convert to list
-            return [make_serializable(item) for item in list(obj)]
+    if isinstance(obj, (set, frozenset)):
+        items = [child(item, i) for i, item in enumerate(cut(_set_order(obj, max_length)))]
+        if max_length is not None and len(obj) > max_length:
+            return _truncated(obj, path, items)
+        return items
 
     # 4. Dictionaries
     if isinstance(obj, dict):
-        return {str(k): make_serializable(v) for k, v in obj.items()}
+        data = {str(k): child(v, str(k)) for k, v in cut(obj.items())}
+        if max_length is not None and len(obj) > max_length:
+            return _truncated(obj, path, data)
+        return data
     
     # 5. Custom Objects (The "Catch-All")
     if hasattr(obj, '__dict__'):
         try:
-            data = {str(k): make_serializable(v) for k, v in obj.__dict__.items() if not k.startswith('__')}
+            attributes = [(k, v) for k, v in obj.__dict__.items() if not k.startswith('__')]
+            data = {str(k): child(v, str(k)) for k, v in cut(attributes)}
+            if max_length is not None and len(attributes) > max_length:
+                return _truncated(obj, path, data)
             data['__type__'] = type(obj).__name__
             return data
         except Exception:
@@ -42,9 +315,849 @@ def make_serializable(obj):
     # 6. Fallback
     return repr(obj)
 
-def trace_python_code(code_string: str, inputs: List[str] = []):
+
+def _child_value(obj, key, limits):
+    """Follow one element of a truncation marker's path."""
+    if isinstance(obj, (list, tuple, deque)):
+        return obj[int(key)]
+    if isinstance(obj, (set, frozenset)):
+        return next(islice(_set_order(obj, limits["max_length"]), int(key), None))
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if str(k) == key:
+                return v
+        raise KeyError(key)
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__[key]
+    raise KeyError(key)
+
+
+def page_value(obj, path, offset: int = 0, limit: int = 100, limits=None) -> dict:
+    """
+    One page of the full value at `path` (variable name first), with each
+    item snapshotted under `limits` so deeper containers stay lazy.
+    """
+    limits = limits or DEFAULT_SNAPSHOT_LIMITS
+    for key in path[1:]:
+        obj = _child_value(obj, key, limits)
+
+    length = _container_length(obj)
+    if length is None:
+        return {"path": list(path), "length": None, "value": make_serializable(obj, limits, tuple(path))}
+
+    if isinstance(obj, dict):
+        entries = [(str(k), v) for k, v in islice(obj.items(), offset, offset + limit)]
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (list, tuple, deque, set, frozenset)):
+        entries = [(str(k), v) for k, v in islice(obj.__dict__.items(), offset, offset + limit)]
+    else:
+        if isinstance(obj, (set, frozenset)):
+            obj = _set_order(obj, limits["max_length"])
+        entries = [(i, v) for i, v in enumerate(islice(obj, offset, offset + limit), start=offset)]
+
+    budget = [limits["max_nodes"]]
+    items = [[key, make_serializable(v, limits, tuple(path) + (key,), budget)] for key, v in entries]
+    return {"path": list(path), "length": length, "offset": offset, "items": items}
+
+
+class HeapSnapshotter:
+    """
+    Snapshots variables as an object graph ("heap" snapshot mode).
+
+    Custom objects are stored once per step in a table keyed by a stable
+    reference number and pointed to as {"__ref__": n}, so shared nodes are
+    not duplicated and cycles terminate. Objects whose attributes are all
+    scalars or references, and unchanged since the previous step, reuse
+    their previous entry: a step costs a walk over the live objects, not a
+    re-serialization of every path through them.
+    """
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        # id(obj) -> [obj, ref, fingerprint, entry] for the previous step.
+        # Holding obj keeps its id() from being reused while it is tracked.
+        self._known = {}
+        self._next_ref = 1
+
+    def snapshot(self, raw_variables: dict):
+        """Return (variables, heap) for one step."""
+        budget = [self.limits["max_nodes"]]
+        known = {}
+        pending = deque()
+
+        def on_object(obj, path):
+            key = id(obj)
+            info = known.get(key)
+            if info is None:
+                previous = self._known.get(key)
+                if previous is not None:
+                    ref = previous[1]
+                else:
+                    ref = self._next_ref
+                    self._next_ref += 1
+                info = known[key] = [obj, ref, None, None]
+                pending.append((info, path, previous))
+            return {"__ref__": info[1]}
+
+        variables = {
+            name: make_serializable(value, self.limits, (name,), budget, on_object)
+            for name, value in raw_variables.items()
+        }
+        # Breadth-first, so long chains of nodes don't recurse
+        heap = {}
+        while pending:
+            info, path, previous = pending.popleft()
+            info[2], info[3] = self._entry(info[0], path, previous, budget, on_object)
+            heap[str(info[1])] = info[3]
+
+        self._known = known
+        return variables, heap
+
+    @staticmethod
+    def _fingerprint(obj, state: dict):
+        """Shallow identity of an object's state, or None if it can't be trusted."""
+        parts = [type(obj)]
+        for key, value in state.items():
+            if isinstance(value, _SCALAR_TYPES):
+                parts.append((key, type(value), value))
+            elif hasattr(value, '__dict__') and not isinstance(value, _CONTAINER_TYPES):
+                parts.append((key, id(value)))
+            else:
+                return None  # Containers may change without the object changing
+        return tuple(parts)
+
+    def _entry(self, obj, path, previous, budget, on_object):
+        """Return (fingerprint, entry) for one object."""
+        try:
+            state = obj.__dict__
+            fingerprint = self._fingerprint(obj, state)
+        except Exception:
+            return None, repr(obj)
+
+        budget[0] -= 1
+        if budget[0] < 0:
+            return None, _truncated(obj, path)
+
+        root = (_HeapPath(path),)
+        if fingerprint is not None and previous is not None and previous[2] == fingerprint:
+            # Unchanged: keep the old entry, but still visit the objects it points to
+            for key, value in state.items():
+                if not isinstance(value, _SCALAR_TYPES) and not key.startswith('__'):
+                    on_object(value, root + (str(key),))
+            return fingerprint, previous[3]
+
+        attributes = [(str(k), v) for k, v in state.items() if not k.startswith('__')]
+
+        max_length = self.limits["max_length"]
+        data = {
+            key: make_serializable(value, self.limits, root + (key,), budget, on_object)
+            for key, value in islice(attributes, max_length)
+        }
+        if len(attributes) > max_length:
+            return None, _truncated(obj, root, data)
+        data['__type__'] = type(obj).__name__
+        return fingerprint, data
+
+
+_SCALAR_TYPE_SET = frozenset(_SCALAR_TYPES)
+_SEQUENCE_TYPES = (list, tuple, deque, set, frozenset)
+
+
+def _fingerprint(obj, depth: int = 0):
+    """
+    Cheap stand-in for the serialized form of a container of scalars, or of
+    containers of scalars (one level down): equal fingerprints mean equal
+    serializations. None when the value can't be fingerprinted this way.
+    Item types are part of it, as 1, 1.0 and True compare equal.
+    """
+    kind = type(obj)
+    if kind in _SCALAR_TYPE_SET:
+        return kind, obj
+    if kind in _SEQUENCE_TYPES:
+        items = tuple(obj)
+    elif kind is dict:
+        keys = tuple(obj)
+        key_types = tuple(map(type, keys))
+        if not _SCALAR_TYPE_SET.issuperset(key_types):
+            return None
+        items = tuple(obj.values())
+        kind = (dict, key_types, keys)
+    else:
+        return None
+    item_types = tuple(map(type, items))
+    if _SCALAR_TYPE_SET.issuperset(item_types):
+        return kind, item_types, items
+    if depth > 0:
+        return None
+    children = tuple(_fingerprint(item, depth + 1) for item in items)
+    if None in children:
+        return None
+    return kind, children
+
+
+class _SnapshotMemo:
+    """
+    Tree-mode snapshots that reuse the previous step's serialization of every
+    variable whose fingerprint (see _fingerprint) hasn't changed, so an
+    unchanged list isn't walked again on every line. Reused values are the
+    same objects as the previous step's, which also makes them cheap to diff.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._entries = {}  # name -> (fingerprint, serialized, budget used)
+
+    def serialize(self, raw_variables: dict) -> dict:
+        limits = self.limits
+        budget = [limits["max_nodes"]] if limits is not None else None  # Shared by every variable of the step
+        entries = {}
+        variables = {}
+        for name, value in raw_variables.items():
+            if type(value) in _SCALAR_TYPE_SET:
+                variables[name] = value
+                continue
+            fingerprint = _fingerprint(value)
+            previous = self._entries.get(name)
+            if (fingerprint is not None and previous is not None and previous[0] == fingerprint
+                    and (budget is None or previous[2] <= budget[0])):
+                _, serialized, used = previous
+                if budget is not None:
+                    budget[0] -= used
+            elif (fingerprint is not None and fingerprint[0] in (list, tuple, deque) and len(fingerprint) == 3
+                    and (budget is None or budget[0] >= 1)):
+                # A sequence of scalars serializes to a plain copy of (the start of) it
+                items = fingerprint[2]
+                if budget is None:
+                    serialized = list(items)
+                else:
+                    budget[0] -= 1
+                    max_length = limits["max_length"]
+                    serialized = list(items) if len(items) <= max_length else (
+                        _truncated(value, (name,), list(items[:max_length]))
+                    )
+                used = 1
+            else:
+                before = budget[0] if budget is not None else 0
+                serialized = make_serializable(value, limits, (name,), budget)
+                used = before - budget[0] if budget is not None else 0
+                if budget is not None and budget[0] < 0:
+                    fingerprint = None  # Cut short by the variables before it
+            if fingerprint is not None:
+                entries[name] = (fingerprint, serialized, used)
+            variables[name] = serialized
+        self._entries = entries
+        return variables
+
+
+class _WatchList:
+    """
+    Variables a trace serializes: those named in `names`, plus those whose
+    type (or a base class) is named in `types`. The rest are reported as
+    {"__unwatched__": type name} so the client still knows they exist.
+    """
+
+    def __init__(self, names=None, types=None):
+        self.names = set(names or ())
+        self.types = set(types or ())
+        self._type_matches = {}  # type -> bool
+
+    def watches(self, name: str, value) -> bool:
+        if name in self.names:
+            return True
+        if not self.types:
+            return False
+        cls = type(value)
+        matches = self._type_matches.get(cls)
+        if matches is None:
+            matches = self._type_matches[cls] = any(base.__name__ in self.types for base in cls.__mro__)
+        return matches
+
+    def split(self, raw_variables: dict):
+        """(watched raw variables, markers for the others)."""
+        watched, markers = {}, {}
+        for name, value in raw_variables.items():
+            if self.watches(name, value):
+                watched[name] = value
+            else:
+                markers[name] = {"__unwatched__": type(value).__name__}
+        return watched, markers
+
+
+class OutputCapture(io.StringIO):
+    """
+    Stand-in for sys.stdout that hands out output in chunks.
+    Each trace step stores only what was written since the previous step,
+    so print-heavy programs grow the response linearly instead of quadratically.
+    Writes stay in the C-level StringIO; the buffer is drained on every chunk.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def take_chunk(self) -> str:
+        """Return everything written since the last call."""
+        chunk = super().getvalue()
+        if chunk:
+            self._chunks.append(chunk)
+            self.seek(0)
+            self.truncate(0)
+        return chunk
+
+    def getvalue(self) -> str:
+        return "".join(self._chunks) + super().getvalue()
+
+
+def _same_value(a, b):
+    """
+    Strict equality for serialized values.
+    Plain `==` treats 1, 1.0 and True as equal, which would hide real changes.
+    """
+    if a is b:
+        return True  # Reused heap entries
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return False
+        item_types = tuple(map(type, a))
+        if _SCALAR_TYPE_SET.issuperset(item_types):
+            return item_types == tuple(map(type, b)) and a == b  # One C-level comparison
+        return all(_same_value(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same_value(v, b[k]) for k, v in a.items())
+    return a == b
+
+
+_DELTA_KEYS = ("changed", "deleted", "heap_changed", "heap_deleted")
+
+
+def _diff(previous: dict, current: dict):
+    changed = {
+        name: value for name, value in current.items()
+        if name not in previous or not _same_value(previous[name], value)
+    }
+    deleted = [name for name in previous if name not in current]
+    return changed, deleted
+
+
+class TraceDeltaEncoder:
+    """
+    Turns full-state (v1) steps into v2 steps, one step at a time.
+    A v2 step has either `keyframe: True` plus the full `variables`, or
+    `changed` (added/changed values) and `deleted` (removed names).
+    Heap-mode steps carry `heap` the same way, as `heap_changed`/`heap_deleted`.
+    Steps without `variables` are passed through untouched.
+    """
+
+    def __init__(self, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.previous = None
+        self.previous_heap = None
+        self.count = 0
+
+    def encode(self, step: dict) -> dict:
+        if "variables" not in step:
+            return step  # Steps without a state (collapsed-loop markers) pass through
+        variables = step["variables"]
+        heap = step.get("heap")
+        encoded = {k: v for k, v in step.items() if k not in ("variables", "heap")}
+
+        if self.previous is None or self.count % self.keyframe_interval == 0:
+            encoded["keyframe"] = True
+            encoded["variables"] = variables
+            if heap is not None:
+                encoded["heap"] = heap
+        else:
+            changed, deleted = _diff(self.previous, variables)
+            if changed:
+                encoded["changed"] = changed
+            if deleted:
+                encoded["deleted"] = deleted
+            if heap is not None:
+                changed, deleted = _diff(self.previous_heap or {}, heap)
+                if changed:
+                    encoded["heap_changed"] = changed
+                if deleted:
+                    encoded["heap_deleted"] = deleted
+
+        self.previous = variables
+        self.previous_heap = heap
+        self.count += 1
+        return encoded
+
+    def force_keyframe(self, encoded: dict) -> dict:
+        """Rewrite the most recently encoded step as a keyframe."""
+        step = {k: v for k, v in encoded.items() if k not in _DELTA_KEYS}
+        step["keyframe"] = True
+        step["variables"] = self.previous if self.previous is not None else {}
+        if self.previous_heap is not None:
+            step["heap"] = self.previous_heap
+        return step
+
+
+def decode_trace_steps(steps: list):
+    """
+    Expand v2 steps back into full-state v1 steps (generator).
+    Also accepts v1 steps, which are passed through unchanged.
+    """
+    current = {}
+    current_heap = None
+    for step in steps:
+        if "variables" in step:
+            current = dict(step["variables"])
+            if "heap" in step:
+                current_heap = dict(step["heap"])
+        else:
+            current = dict(current)
+            current.update(step.get("changed", {}))
+            for name in step.get("deleted", []):
+                current.pop(name, None)
+            if current_heap is not None:
+                current_heap = dict(current_heap)
+                current_heap.update(step.get("heap_changed", {}))
+                for ref in step.get("heap_deleted", []):
+                    current_heap.pop(ref, None)
+        full = {k: v for k, v in step.items() if k not in ("keyframe",) + _DELTA_KEYS}
+        full["variables"] = current
+        if current_heap is not None:
+            full["heap"] = current_heap
+        yield full
+
+
+# --- Loop summarization ---
+# With summarize_loops, each loop shows its first LOOP_HEAD_ITERATIONS
+# iterations in full; later iterations collapse into "collapsed" marker steps,
+# except sampled iterations (the 4th, 8th, 16th, ...: one step at the loop
+# header) and steps on lines the loop had not run before (a new branch).
+# A marker's "from"/"to" step numbers can be re-traced in full with step_range.
+LOOP_HEAD_ITERATIONS = int(os.getenv("LOOP_HEAD_ITERATIONS", "3"))
+
+
+def _loop_ranges(code_string: str) -> dict:
+    """{header line: last line} of every for/while loop in the code."""
+    ranges = {}
+    for node in ast.walk(ast.parse(code_string)):
+        if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            ranges[node.lineno] = node.end_lineno
+    return ranges
+
+
+class _LoopSummarizer:
+    """Decides, line event by line event, which steps a summarized trace keeps."""
+
+    def __init__(self, loop_ranges: dict, head: int = LOOP_HEAD_ITERATIONS):
+        self.loop_ranges = loop_ranges
+        self.head = max(1, head)
+        # Running loops, outermost first: [frame, header, end, iteration, lines seen]
+        self.active = []
+        self.skipped_from = None
+        self.skipped_to = None
+        self.skipped_loop = None
+
+    def _prune(self, frame, line):
+        """Drop loops that have finished (or whose frame has returned)."""
+        live_frames = None
+        kept = []
+        for state in self.active:
+            loop_frame, header, end = state[0], state[1], state[2]
+            if loop_frame is frame:
+                if header <= line <= end:
+                    kept.append(state)
+                continue
+            if live_frames is None:
+                live_frames = set()
+                caller = frame.f_back
+                while caller is not None:
+                    live_frames.add(id(caller))
+                    caller = caller.f_back
+            if id(loop_frame) in live_frames:
+                kept.append(state)
+        self.active = kept
+
+    def keep(self, frame, line: int, index: int) -> bool:
+        if self.active:
+            self._prune(frame, line)
+        if line in self.loop_ranges:
+            for state in self.active:
+                if state[0] is frame and state[1] == line:
+                    state[3] += 1
+                    break
+            else:
+                self.active.append([frame, line, self.loop_ranges[line], 1, set()])
+
+        keep = True
+        for state in self.active:
+            iteration, seen = state[3], state[4]
+            if iteration <= self.head or line not in seen:
+                pass
+            elif state[0] is frame and line == state[1] and iteration & (iteration - 1) == 0:
+                pass  # Sampled iteration: keep its header step
+            elif keep:
+                keep = False
+                if self.skipped_from is None:
+                    self.skipped_loop = state[1]
+            seen.add(line)
+
+        if not keep:
+            if self.skipped_from is None:
+                self.skipped_from = index
+            self.skipped_to = index
+        return keep
+
+    def take_collapsed(self) -> Optional[dict]:
+        """The marker for the steps skipped since the last kept one, if any."""
+        if self.skipped_from is None:
+            return None
+        marker = {
+            "line": self.skipped_loop,
+            "event": "collapsed",
+            "collapsed": {
+                "from": self.skipped_from,
+                "to": self.skipped_to,
+                "steps": self.skipped_to - self.skipped_from + 1,
+                "loop_line": self.skipped_loop,
+            },
+        }
+        self.skipped_from = self.skipped_to = self.skipped_loop = None
+        return marker
+
+
+# --- Step over ---
+# Functions outside the focus set run without line tracing. A call into one
+# from a traced frame is recorded as a "call" step and a "return" step (with
+# the arguments and the return value) so the call can be shown collapsed.
+
+
+class _FunctionFocus:
+    """
+    Which user code objects are traced line by line.
+    Module and class bodies always are; functions are matched by name or
+    qualified name ("helper", "Tree.insert", "<listcomp>").
+    """
+
+    def __init__(self, trace_functions=None, skip_functions=None, step_over_calls: bool = False):
+        self.trace_functions = set(trace_functions) if trace_functions is not None else None
+        self.skip_functions = set(skip_functions or ())
+        self.step_over_calls = step_over_calls
+        self._traced = {}  # code object -> bool
+
+    @property
+    def active(self) -> bool:
+        return self.trace_functions is not None or bool(self.skip_functions) or self.step_over_calls
+
+    def traces(self, code) -> bool:
+        traced = self._traced.get(code)
+        if traced is None:
+            traced = self._traced[code] = self._decide(code)
+        return traced
+
+    def _decide(self, code) -> bool:
+        if code.co_filename != USER_CODE_FILENAME:
+            return False
+        if not code.co_flags & inspect.CO_OPTIMIZED:
+            return True  # Module and class bodies
+        names = {code.co_name, getattr(code, "co_qualname", code.co_name)}
+        if names & self.skip_functions or self.step_over_calls:
+            return False
+        return self.trace_functions is None or bool(names & self.trace_functions)
+
+
+def _call_arguments(frame) -> dict:
+    """The parameters of a frame that has just started, by name."""
+    code = frame.f_code
+    count = code.co_argcount + code.co_kwonlyargcount
+    count += bool(code.co_flags & inspect.CO_VARARGS) + bool(code.co_flags & inspect.CO_VARKEYWORDS)
+    local_vars = frame.f_locals
+    # Comprehensions take their iterator as a hidden ".0" argument
+    return {
+        name: local_vars[name] for name in code.co_varnames[:count]
+        if name in local_vars and not name.startswith(".")
+    }
+
+
+class _PrefixMismatch(BaseException):
+    """A fast-forwarded run left the line sequence it was expected to follow."""
+
+
+class _StopTrace(BaseException):
+    """Ends a probed run early (a BaseException, so user code can't catch it by accident)."""
+
+
+def _iter_code_objects(code):
+    """Yield a code object and every code object nested in it (functions, classes, lambdas)."""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _iter_code_objects(const)
+
+
+@contextmanager
+def _settrace_hook(code, on_line, focus=None, on_boundary=None):
+    def tracer(frame, event, arg):
+        if event == 'call':
+            if frame.f_code.co_filename != USER_CODE_FILENAME:
+                return None  # Don't trace into helpers called from user code
+            if focus is not None and not focus.traces(frame.f_code):
+                caller = frame.f_back
+                if caller is None or not focus.traces(caller.f_code):
+                    return None  # Nested in stepped-over code: runs untraced
+                on_boundary("call", frame)
+                frame.f_trace_lines = False  # Only the return is reported
+                return boundary_tracer
+        if event == 'line':
+            on_line(frame, frame.f_lineno)
+        return tracer
+
+    def reinstall(frame):
+        """Put the hook back on the running user frames (CPython drops it when the hook raises)."""
+        sys.settrace(tracer)
+        while frame is not None:
+            if frame.f_code.co_filename == USER_CODE_FILENAME:
+                frame.f_trace = tracer
+                frame.f_trace_lines = True
+            frame = frame.f_back
+
+    def boundary_tracer(frame, event, arg):
+        # An exception leaving the frame also reports 'return' (with None).
+        # After an 'exception' event, line events are switched on until the
+        # next one: a line means the exception was handled in the frame.
+        if event == 'exception':
+            frame.f_trace_lines = True
+        elif event == 'line':
+            frame.f_trace_lines = False
+        elif event == 'return':
+            on_boundary("raise" if frame.f_trace_lines else "return", frame, arg)
+        return boundary_tracer
+
+    original_trace = sys.gettrace()
+    sys.settrace(tracer)
+    try:
+        yield reinstall
+    finally:
+        sys.settrace(original_trace)
+
+
+def _free_monitoring_tool_id():
+    monitoring = sys.monitoring
+    for tool_id in (monitoring.DEBUGGER_ID, 3, 4):
+        if monitoring.get_tool(tool_id) is None:
+            return tool_id
+    raise RuntimeError("No free sys.monitoring tool id")
+
+
+def _offset_lines(code):
+    """Map each bytecode offset of `code` to its source line."""
+    lines = {}
+    for start, end, line in code.co_lines():
+        for offset in range(start, end, 2):
+            lines[offset] = line
+    return lines
+
+
+@contextmanager
+def _monitoring_hook(code, on_line, focus=None, on_boundary=None):
+    monitoring = sys.monitoring
+    events = monitoring.events
+    tool_id = _free_monitoring_tool_id()
+    user_codes = list(_iter_code_objects(code))
+    if focus is not None:
+        traced_codes = [user_code for user_code in user_codes if focus.traces(user_code)]
+        skipped_codes = [user_code for user_code in user_codes if not focus.traces(user_code)]
+    else:
+        traced_codes, skipped_codes = user_codes, []
+    offset_lines = {user_code: _offset_lines(user_code) for user_code in traced_codes}
+    boundary_frames = set()  # Stepped-over frames with an open "call" step
+
+    def line_callback(code_obj, line_number):
+        # Called straight from the user's frame, which is one level up.
+        on_line(sys._getframe(1), line_number)
+
+    def jump_callback(code_obj, from_offset, to_offset):
+        # Mirror sys.settrace: a backward jump that stays on the same line
+        # (one-line loops, comprehensions) still counts as a new line event.
+        if to_offset > from_offset:
+            return monitoring.DISABLE
+        lines = offset_lines[code_obj]
+        to_line = lines.get(to_offset)
+        if to_line is not None and to_line == lines.get(from_offset):
+            on_line(sys._getframe(1), to_line)
+
+    def start_callback(code_obj, instruction_offset):
+        # Traced code: nothing to record; enabling PY_START makes LINE fire
+        # for the first line of a code object, as sys.settrace does.
+        # Stepped-over code (also on PY_RESUME, like settrace's 'call'):
+        # report the call when it comes from a traced frame.
+        if focus is None or focus.traces(code_obj):
+            return None
+        frame = sys._getframe(1)
+        if frame.f_back is not None and focus.traces(frame.f_back.f_code):
+            boundary_frames.add(frame)
+            on_boundary("call", frame)
+
+    def return_callback(code_obj, instruction_offset, retval):
+        frame = sys._getframe(1)
+        if frame in boundary_frames:
+            boundary_frames.discard(frame)
+            on_boundary("return", frame, retval)
+
+    def unwind_callback(code_obj, instruction_offset, exception):
+        frame = sys._getframe(1)
+        if frame in boundary_frames:
+            boundary_frames.discard(frame)
+            on_boundary("raise", frame)
+
+    monitoring.use_tool_id(tool_id, _MONITORING_TOOL_NAME)
+    boundary_events = events.PY_START | events.PY_RESUME | events.PY_RETURN | events.PY_YIELD
+    try:
+        monitoring.register_callback(tool_id, events.LINE, line_callback)
+        monitoring.register_callback(tool_id, events.JUMP, jump_callback)
+        monitoring.register_callback(tool_id, events.PY_START, start_callback)
+        # Only the user's own code objects get events; builtins, stdlib and
+        # our helpers run without any tracing overhead.
+        for user_code in traced_codes:
+            monitoring.set_local_events(tool_id, user_code, events.LINE | events.JUMP | events.PY_START)
+        if skipped_codes:
+            monitoring.register_callback(tool_id, events.PY_RESUME, start_callback)
+            monitoring.register_callback(tool_id, events.PY_RETURN, return_callback)
+            monitoring.register_callback(tool_id, events.PY_YIELD, return_callback)
+            # PY_UNWIND can only be enabled globally; it fires only while an
+            # exception propagates
+            monitoring.register_callback(tool_id, events.PY_UNWIND, unwind_callback)
+            monitoring.set_events(tool_id, events.PY_UNWIND)
+            for user_code in skipped_codes:
+                monitoring.set_local_events(tool_id, user_code, boundary_events)
+        # A callback that raises stays registered: nothing to reinstall
+        yield lambda frame: None
+    finally:
+        monitoring.set_events(tool_id, events.NO_EVENTS)
+        for user_code in user_codes:
+            monitoring.set_local_events(tool_id, user_code, events.NO_EVENTS)
+        for event in (events.LINE, events.JUMP, events.PY_START, events.PY_RESUME,
+                      events.PY_RETURN, events.PY_YIELD, events.PY_UNWIND):
+            monitoring.register_callback(tool_id, event, None)
+        monitoring.free_tool_id(tool_id)
+
+
+_TRACE_HOOKS = {BACKEND_SETTRACE: _settrace_hook}
+if hasattr(sys, "monitoring"):
+    _TRACE_HOOKS[BACKEND_MONITORING] = _monitoring_hook
+
+_CALIBRATION_CODE = """
+total = 0
+items = []
+for i in range(300):
+    total += i
+    if i % 3 == 0:
+        items.append(i)
+"""
+
+
+@lru_cache(maxsize=None)
+def select_backend() -> str:
+    """
+    Pick the tracing backend for this process.
+    Honors TRACE_BACKEND when it names an available backend; otherwise times
+    every available backend on a small loop and keeps the fastest.
+    """
+    if TRACE_BACKEND in _TRACE_HOOKS:
+        return TRACE_BACKEND
+    if len(_TRACE_HOOKS) == 1:
+        return BACKEND_SETTRACE
+
+    timings = {}
+    for backend in _TRACE_HOOKS:
+        start = time.perf_counter()
+        trace_python_code(_CALIBRATION_CODE, backend=backend)
+        timings[backend] = time.perf_counter() - start
+    return min(timings, key=timings.get)
+
+
+def trace_python_code(
+    code_string: str,
+    inputs: List[str] = [],
+    trace_format: int = TRACE_FORMAT_V1,
+    keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    backend: str = BACKEND_AUTO,
+    on_step=None,
+    snapshot_limits=None,
+    snapshot_mode: str = SNAPSHOT_TREE,
+    trace_limits=None,
+    summarize_loops: bool = False,
+    step_range: Optional[Tuple[int, int]] = None,
+    fast_forward: Optional[List[int]] = None,
+    probe=None,
+    trace_functions: Optional[List[str]] = None,
+    skip_functions: Optional[List[str]] = None,
+    step_over_calls: bool = False,
+    watch: Optional[List[str]] = None,
+    watch_types: Optional[List[str]] = None,
+):
+    """
+    Run `code_string` under the tracer and return the trace.
+    When `on_step` is given, steps are handed to it as they are produced
+    instead of being kept, and the returned "steps" list is empty.
+    `snapshot_limits` overrides DEFAULT_SNAPSHOT_LIMITS (up to the ceilings);
+    plain v1 tree traces are only capped when it is given.
+    `snapshot_mode` is one of SNAPSHOT_MODES; "heap" adds a "heap" object
+    table to every step.
+    `trace_limits` overrides DEFAULT_TRACE_LIMITS (up to the ceilings); when
+    one is hit the partial trace is returned with a "limit_exceeded" entry.
+    max_steps counts the trace's steps, not the lines executed to produce them.
+    `summarize_loops` collapses long loops (see _LoopSummarizer).
+    `step_range=(start, stop)` keeps only steps numbered start..stop (the
+    numbering of a full trace, as used by "collapsed" markers).
+    `fast_forward` lists the lines the first steps are known to run: those
+    steps are executed but not recorded, and if the run strays from the list
+    the result is just {"prefix_mismatch": True}.
+    `probe(step_index, raw_variables)` replaces recording entirely: nothing is
+    serialized, and the run stops as soon as the probe returns True.
+    `trace_functions` (only these functions), `skip_functions` (all but
+    these) and `step_over_calls` (no functions at all) pick which functions
+    are traced line by line; calls into the others from traced code become
+    "call"/"return" steps (see _FunctionFocus).
+    `watch` (variable names) and `watch_types` (type names) restrict
+    serialization to the matching variables (see _WatchList).
+    Results carry "timings" (seconds spent executing, snapshotting and
+    encoding steps).
+    """
+    if trace_format not in SUPPORTED_TRACE_FORMATS:
+        raise ValueError(f"Unsupported trace format: {trace_format}")
+    if snapshot_mode not in SNAPSHOT_MODES:
+        raise ValueError(f"Unsupported snapshot mode: {snapshot_mode}")
+    if backend == BACKEND_AUTO:
+        backend = select_backend()
+    if backend not in _TRACE_HOOKS:
+        raise ValueError(f"Tracing backend not available: {backend}")
+
     trace = []
-    output_capture = io.StringIO()
+    encoder = TraceDeltaEncoder(keyframe_interval) if trace_format == TRACE_FORMAT_V2 else None
+
+    governor = resolve_trace_limits(trace_limits)
+    deadline = time.monotonic() + governor["max_seconds"]
+    trace_size = _TraceSize()
+    encoding_seconds = 0.0  # v2 delta encoding and size accounting
+
+    recorded_steps = 0
+
+    def record(step):
+        nonlocal recorded_steps, encoding_seconds
+        start = time.perf_counter()
+        encoded = encoder.encode(step) if encoder else step
+        trace_size.add(encoded)
+        encoding_seconds += time.perf_counter() - start
+        recorded_steps += 1
+        trace.append(encoded)
+        # Streaming: hold back only the latest step (it may become a keyframe)
+        if on_step is not None and len(trace) > 1:
+            on_step(trace.pop(0))
+
+    def flush():
+        if on_step is not None:
+            for step in trace:
+                on_step(step)
+            trace.clear()
+
+    output_capture = OutputCapture()
     
     class MockInput:
         def __init__(self, inputs_list):
@@ -62,51 +1175,278 @@ def trace_python_code(code_string: str, inputs: List[str] = []):
 
     mock_input_function = MockInput(inputs)
 
-    def tracer(frame, event, arg):
-        if event == 'line':
-            variables = {}
-            # Capture locals
-            for name, value in frame.f_locals.items():
-                if not name.startswith('__') and not callable(value):
-                     if not isinstance(value, (types.ModuleType, types.FunctionType)):
-                        variables[name] = make_serializable(value)
-            
-            # Capture globals (only modified/custom ones)
-            for name, value in frame.f_globals.items():
-                if not name.startswith('__') and name not in variables and not callable(value):
-                    if not isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType)):
-                         variables[name] = make_serializable(value)
-
-            current_output = output_capture.getvalue()
-
-            trace.append({
-                "line": frame.f_lineno,
-                "event": "line",
-                "variables": variables,
-                "output": current_output
-            })
-        return tracer
+    capped = snapshot_limits is not None or trace_format != TRACE_FORMAT_V1 or snapshot_mode == SNAPSHOT_HEAP
+    limits = resolve_snapshot_limits(snapshot_limits) if capped else None
+    step_index = 0
+
+    heap_snapshotter = HeapSnapshotter(limits) if snapshot_mode == SNAPSHOT_HEAP else None
+    snapshot_memo = _SnapshotMemo(limits)
+    run_started = time.perf_counter()
+    snapshot_seconds = 0.0
+    watch_list = _WatchList(watch, watch_types) if watch is not None or watch_types is not None else None
+
+    def serialize(raw_variables):
+        if heap_snapshotter is not None:
+            variables, heap = heap_snapshotter.snapshot(raw_variables)
+            return {"variables": variables, "heap": heap}
+        return {"variables": snapshot_memo.serialize(raw_variables)}
+
+    def snapshot(raw_variables):
+        """The "variables" (and "heap") fields of a step."""
+        nonlocal snapshot_seconds
+        start = time.perf_counter()
+        if watch_list is None:
+            fields = serialize(raw_variables)
+        else:
+            watched, markers = watch_list.split(raw_variables)
+            fields = serialize(watched)
+            serialized = fields["variables"]
+            fields["variables"] = {
+                name: serialized[name] if name in watched else markers[name]
+                for name in raw_variables
+            }
+        snapshot_seconds += time.perf_counter() - start
+        return fields
+
+    def timings():
+        """
+        Where the run's time went: "snapshot" (serializing values),
+        "step_encoding" (v2 deltas and size accounting) and the rest ("execute").
+        """
+        total = time.perf_counter() - run_started
+        return {
+            "execute": total - snapshot_seconds - encoding_seconds,
+            "snapshot": snapshot_seconds,
+            "step_encoding": encoding_seconds,
+        }
+
+    summarizer = _LoopSummarizer(_loop_ranges(code_string)) if summarize_loops else None
+    last_line = None
+    focus = _FunctionFocus(trace_functions, skip_functions, step_over_calls)
+    if not focus.active:
+        focus = None
+    # Call/return steps belong to the line step they happen in, and are
+    # kept only when that step was
+    keep_boundaries = False
+
+    def wanted(frame, line_number, index) -> bool:
+        """Whether this step goes into the trace (before it is serialized)."""
+        if step_range is not None:
+            if index < step_range[0]:
+                output_capture.take_chunk()  # Output before the range isn't part of it
+                return False
+            if index > step_range[1]:
+                raise _StopTrace()
+        if summarizer is not None:
+            if not summarizer.keep(frame, line_number, index):
+                return False
+            record_collapsed()
+        return True
+
+    def record_collapsed():
+        marker = summarizer.take_collapsed() if summarizer is not None else None
+        if marker is not None:
+            marker["output_chunk"] = output_capture.take_chunk()
+            record(marker)
+
+    def trace_steps() -> int:
+        """Steps of the trace so far, as max_steps counts them."""
+        if probe is not None:
+            return probe_index
+        if fast_forward is not None:
+            return min(step_index, len(fast_forward)) + recorded_steps  # Reused steps + new ones
+        return recorded_steps
+
+    def check_limits(counted):
+        if counted >= governor["max_steps"]:
+            raise TraceLimitExceeded("max_steps", governor["max_steps"])
+        if time.monotonic() > deadline:
+            raise TraceLimitExceeded("max_seconds", governor["max_seconds"])
+        if trace_size.bytes > governor["max_trace_bytes"]:
+            raise TraceLimitExceeded("max_trace_bytes", governor["max_trace_bytes"])
+
+    def refusing(capture):
+        """
+        Wrap a hook callback. Whatever ends the run (a limit, the end of a
+        range or probe, an aborted stream) is remembered, and every later
+        event raises it again: a student's bare `except:` can catch it once
+        but can't keep the program running.
+        """
+        def callback(*args):
+            nonlocal stopping
+            if stopping is not None:
+                raise stopping
+            try:
+                return capture(*args)
+            except BaseException as e:
+                stopping = e
+                rearm_alarm()
+                raise
+        return callback
+
+    def on_alarm(frame):
+        nonlocal stopping
+        if not running:
+            return  # Already out of the user's code
+        if stopping is None:
+            stopping = TraceLimitExceeded("max_seconds", governor["max_seconds"])
+        reinstall_hook(frame)
+        raise stopping
+
+    def run_user_code(compiled):
+        nonlocal running
+        running = True
+        try:
+            exec(compiled, execution_globals)
+        except BaseException:
+            if stopping is None:
+                raise
+        finally:
+            running = False
+        if stopping is not None:
+            raise stopping  # Caught by the program, which then went on
+
+    probe_index = 0
+
+    def next_probe_index():
+        """Probed step numbers follow the trace's own: line steps plus call/return steps."""
+        nonlocal probe_index
+        probe_index += 1
+        return probe_index - 1
+
+    def capture_boundary(event, frame, value=None):
+        """A "call"/"return" step for a stepped-over function ("raise" = left by an exception)."""
+        nonlocal snapshot_seconds
+        if not keep_boundaries:
+            return
+        # A single line can make any number of calls
+        check_limits(trace_steps())
+        if probe is not None:
+            # What the step's markers point into: arguments by name, "<return>"
+            if event == "call":
+                raw_values = _call_arguments(frame)
+            else:
+                raw_values = {"<return>": value} if event == "return" else {}
+            if probe(next_probe_index(), raw_values):
+                raise _StopTrace()
+            return
+        code = frame.f_code
+        step = {
+            "line": frame.f_back.f_lineno if frame.f_back is not None else last_line,
+            "event": "call" if event == "call" else "return",
+            "function": getattr(code, "co_qualname", code.co_name),
+        }
+        start = time.perf_counter()
+        if event == "call":
+            budget = [limits["max_nodes"]] if capped else None
+            step["arguments"] = {
+                name: make_serializable(arg, limits, (name,), budget)
+                for name, arg in _call_arguments(frame).items()
+            }
+        elif event == "return":
+            step["return_value"] = make_serializable(value, limits, ("<return>",))
+        else:
+            step["raised"] = True
+        snapshot_seconds += time.perf_counter() - start
+        step["output_chunk"] = output_capture.take_chunk()
+        record(step)
+
+    def capture_line(frame, line_number):
+        nonlocal step_index, last_line, keep_boundaries
+        last_line = line_number
+        keep_boundaries = False
+        check_limits(trace_steps())
+
+        index = step_index
+        step_index += 1
+        if fast_forward is not None and index < len(fast_forward):
+            if line_number != fast_forward[index]:
+                raise _PrefixMismatch()
+            output_capture.take_chunk()  # Already part of the reused steps
+            return
+        if probe is None and not wanted(frame, line_number, index):
+            return
+        keep_boundaries = True
+
+        raw_variables = {}
+        # Capture locals
+        for name, value in frame.f_locals.items():
+            if not name.startswith('__') and not callable(value):
+                 if not isinstance(value, (types.ModuleType, types.FunctionType)):
+                    raw_variables[name] = value
+
+        # Capture globals (only modified/custom ones)
+        for name, value in frame.f_globals.items():
+            if not name.startswith('__') and name not in raw_variables and not callable(value):
+                if not isinstance(value, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType)):
+                     raw_variables[name] = value
+
+        if probe is not None:
+            if probe(next_probe_index(), raw_variables):
+                raise _StopTrace()
+            return
+
+        record({
+            "line": line_number,
+            "event": "line",
+            **snapshot(raw_variables),
+            "output_chunk": output_capture.take_chunk()
+        })
+
+    stopping = None  # The exception ending the run, once one was raised
+    running = False
+    reinstall_hook = rearm_alarm = None  # Set when the hook and the alarm are in place
 
     execution_globals = {
+        # A copy, so `__builtins__` changes stay within this run
+        '__builtins__': dict(builtins.__dict__),
         'input': mock_input_function,
         'list': list, 'dict': dict, 'set': set, 'len': len, 'range': range, # builtins
     }
     
-    original_trace = sys.gettrace()
+    trace_hook = _TRACE_HOOKS[backend]
     original_stdout = sys.stdout 
     sys.stdout = output_capture
-    sys.settrace(tracer)
     
     try:
-        exec(code_string, execution_globals)
-    except Exception as e:
-        sys.settrace(original_trace)
+        compiled = compile(code_string, USER_CODE_FILENAME, "exec")
+        hook = trace_hook(compiled, refusing(capture_line), focus, refusing(capture_boundary))
+        with hook as reinstall_hook, _deadline_alarm(governor["max_seconds"], on_alarm) as rearm_alarm:
+            run_user_code(compiled)
+    except _PrefixMismatch:
+        return {"format": trace_format, "steps": [], "error": None, "final_output": "", "prefix_mismatch": True}
+    except _StopTrace:
+        if encoder and trace:
+            trace[-1] = encoder.force_keyframe(trace[-1])
+        flush()
+        return {
+            "format": trace_format, "steps": trace, "error": None,
+            "final_output": output_capture.getvalue(), "timings": timings(),
+        }
+    except (Exception, TraceLimitExceeded) as e:
         sys.stdout = original_stdout 
-        error_line = trace[-1]['line'] if trace else 'unknown'
+        if fast_forward is not None and step_index <= len(fast_forward):
+            # The earlier run got past this point, so the reused steps can't be trusted
+            return {"format": trace_format, "steps": [], "error": None, "final_output": "", "prefix_mismatch": True}
+        error_line = last_line if last_line is not None else 'unknown'
+        record_collapsed()
         final_output = output_capture.getvalue()
-        return {"steps": trace, "error": f"Error on line {error_line}: {type(e).__name__}: {e}", "final_output": final_output}
+        if encoder and trace:
+            # Keep the last step self-contained so callers can read the final state.
+            trace[-1] = encoder.force_keyframe(trace[-1])
+        flush()
+        result = {
+            "format": trace_format,
+            "steps": trace,
+            "error": f"Error on line {error_line}: {type(e).__name__}: {e}",
+            "final_output": final_output,
+            "timings": timings(),
+        }
+        if isinstance(e, TraceLimitExceeded):
+            result["error"] = f"Execution stopped on line {error_line}: {e}"
+            result["limit_exceeded"] = {"limit": e.limit, "value": e.value, "line": error_line, "steps": step_index}
+        return result
     finally:
-        sys.settrace(original_trace)
         sys.stdout = original_stdout
     
     # Capture final state
@@ -114,13 +1454,77 @@ def trace_python_code(code_string: str, inputs: List[str] = []):
     for name, value in execution_globals.items():
         if not name.startswith('__') and name not in ['input'] and not callable(value):
              if not isinstance(value, (types.ModuleType, types.FunctionType)):
-                final_variables[name] = make_serializable(value)
-
-    trace.append({
-        "line": None,
-        "event": "finished",
-        "variables": final_variables,
-        "output": output_capture.getvalue()
-    })
-        
-    return {"steps": trace, "error": None}
+                final_variables[name] = value
+
+    if probe is not None:
+        probe(next_probe_index(), final_variables)
+        return {"format": trace_format, "steps": [], "error": None, "final_output": output_capture.getvalue()}
+    if fast_forward is not None and step_index < len(fast_forward):
+        return {"format": trace_format, "steps": [], "error": None, "final_output": "", "prefix_mismatch": True}
+
+    record_collapsed()
+    if step_range is None or step_range[0] <= step_index <= step_range[1]:
+        record({
+            "line": None,
+            "event": "finished",
+            **snapshot(final_variables),
+            "output_chunk": output_capture.take_chunk()
+        })
+    if encoder and trace:
+        trace[-1] = encoder.force_keyframe(trace[-1])
+    flush()
+
+    return {
+        "format": trace_format,
+        "steps": trace,
+        "error": None,
+        "final_output": output_capture.getvalue(),
+        "timings": timings(),
+    }
+
+
+def inspect_value(
+    code_string: str,
+    inputs: List[str],
+    step: int,
+    path: list,
+    offset: int = 0,
+    limit: int = 100,
+    snapshot_limits=None,
+    trace_limits=None,
+    trace_functions: Optional[List[str]] = None,
+    skip_functions: Optional[List[str]] = None,
+    step_over_calls: bool = False,
+) -> dict:
+    """
+    Re-run the code up to `step` (without serializing anything on the way)
+    and return one page of the full value at `path`, as found in a
+    truncation marker. Relies on the program being deterministic.
+    The function focus options must match the trace's, since they decide
+    which steps it has (call/return steps are numbered too).
+    """
+    limits = resolve_snapshot_limits(snapshot_limits)
+    found = {}
+
+    def probe(index, raw_variables):
+        if index < step:
+            return False
+        name = path[0] if path else None
+        if name not in raw_variables:
+            found["error"] = f"Variable '{name}' does not exist at step {step}."
+            return True
+        try:
+            found["page"] = page_value(raw_variables[name], list(path), offset, limit, limits)
+        except (KeyError, IndexError, ValueError, StopIteration):
+            found["error"] = f"Path {list(path)} does not exist at step {step}."
+        return True
+
+    result = trace_python_code(
+        code_string, inputs, trace_limits=trace_limits, probe=probe,
+        trace_functions=trace_functions, skip_functions=skip_functions, step_over_calls=step_over_calls,
+    )
+    if not found:
+        if "limit_exceeded" in result:
+            return {"error": f"Step {step} was not reached: {result['error']}"}
+        return {"error": f"Step {step} was not reached."}
+    return found.get("page") or {"error": found["error"]}
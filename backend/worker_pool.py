@@ -0,0 +1,423 @@
+import asyncio
+import builtins
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from backend.tracer import resolve_trace_limits, trace_python_code
+
+# --- Pool configuration (per deployment) ---
+# TRACE_WORKERS: number of pre-started worker processes (default: CPU count)
+# TRACE_QUEUE_LIMIT: max jobs running + waiting before new ones are rejected
+# TRACE_WORKER_MAX_TASKS: recycle a worker after this many jobs (0 = never);
+#   a backstop for whatever a job can change that _JobIsolation doesn't restore
+# TRACE_JOB_GRACE_SECONDS: a worker still busy this long past its trace's
+#   time limit is killed (and the pool replaced)
+# TRACE_JOB_TIMEOUT: the same hard limit for jobs without a trace time limit
+# TRACE_WORKER_MEMORY_MB: address-space limit (RLIMIT_AS) of each worker (0 = none)
+TRACE_WORKERS = int(os.getenv("TRACE_WORKERS", str(os.cpu_count() or 1)))
+TRACE_QUEUE_LIMIT = int(os.getenv("TRACE_QUEUE_LIMIT", str(TRACE_WORKERS * 4)))
+TRACE_WORKER_MAX_TASKS = int(os.getenv("TRACE_WORKER_MAX_TASKS", "200"))
+TRACE_JOB_GRACE_SECONDS = float(os.getenv("TRACE_JOB_GRACE_SECONDS", "5"))
+TRACE_JOB_TIMEOUT = float(os.getenv("TRACE_JOB_TIMEOUT", "60"))
+TRACE_WORKER_MEMORY_MB = int(os.getenv("TRACE_WORKER_MEMORY_MB", "2048"))
+
+# --- Sandbox ---
+# Environment variables whose name contains one of these never reach a worker
+SECRET_ENV_MARKERS = ("KEY", "SECRET", "TOKEN", "PASSWORD", "PASSWD", "CREDENTIAL", "DATABASE_URL")
+
+# --- Streaming ---
+# Steps travel from the worker in batches over a bounded queue, so a slow
+# client slows the worker down instead of piling steps up in memory.
+STREAM_BATCH_SIZE = 50
+STREAM_QUEUE_SIZE = 8
+STREAM_PUT_TIMEOUT = 30.0
+# How often the reaper looks for jobs past their hard timeout
+REAPER_INTERVAL = 0.5
+
+
+class PoolBusyError(Exception):
+    """Raised when the queue-depth limit is reached (the caller should retry later)."""
+
+
+def _is_secret_env(name: str) -> bool:
+    name = name.upper()
+    return any(marker in name for marker in SECRET_ENV_MARKERS)
+
+
+@contextmanager
+def _secrets_hidden():
+    """
+    Take secrets out of the environment while helper processes (forkserver,
+    manager) start: workers forked from them would otherwise still find them
+    in /proc/self/environ after _init_worker cleared os.environ.
+    """
+    hidden = {name: os.environ.pop(name) for name in list(os.environ) if _is_secret_env(name)}
+    try:
+        yield
+    finally:
+        os.environ.update(hidden)
+
+
+def _set_limit(kind: int, soft: int, hard: int):
+    _, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def _init_worker():
+    for name in list(os.environ):
+        if _is_secret_env(name):
+            del os.environ[name]
+    if resource is not None and TRACE_WORKER_MEMORY_MB > 0:
+        # A program allocating too much gets a MemoryError instead of the host's OOM killer
+        limit = TRACE_WORKER_MEMORY_MB * 1024 * 1024
+        _set_limit(resource.RLIMIT_AS, limit, limit)
+    # Importing here makes sure the tracer is loaded before the first job,
+    # even with the "spawn" start method. Picking the tracing backend (which
+    # may time each one) also happens now rather than on a user's request.
+    from backend.tracer import select_backend
+    select_backend()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class _JobIsolation:
+    """
+    Process-wide state a student's program can change, saved before a job
+    and put back after it, so the next job on this worker starts clean:
+    the builtins module, the recursion limit, the standard streams,
+    sys.path and sys.modules entries, the working directory and environment.
+    """
+
+    def __init__(self):
+        self.builtins = dict(builtins.__dict__)
+        self.recursion_limit = sys.getrecursionlimit()
+        self.streams = (sys.stdin, sys.stdout, sys.stderr)
+        self.path = list(sys.path)
+        self.modules = dict(sys.modules)
+        self.cwd = os.getcwd()
+        self.environ = dict(os.environ)
+
+    def restore(self):
+        builtins.__dict__.clear()
+        builtins.__dict__.update(self.builtins)
+        sys.setrecursionlimit(self.recursion_limit)
+        sys.stdin, sys.stdout, sys.stderr = self.streams
+        sys.path[:] = self.path
+        for name, module in self.modules.items():
+            if sys.modules.get(name) is not module:
+                sys.modules[name] = module
+        os.chdir(self.cwd)
+        if os.environ != self.environ:
+            os.environ.clear()
+            os.environ.update(self.environ)
+
+
+def _limit_cpu(seconds: float):
+    """
+    Let this worker use `seconds` more CPU time before the kernel kills it
+    (RLIMIT_CPU counts the whole process lifetime, so it's moved per job).
+    A backstop for the reaper, which goes by wall-clock time and fires first.
+    """
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _set_limit(resource.RLIMIT_CPU, soft, resource.RLIM_INFINITY)
+
+
+def _run_job(running, job_id: int, timeout: float, fn, *args, **kwargs):
+    """
+    Run one job in a worker, isolated from the jobs before and after it.
+    While it runs, running[job_id] = (pid, deadline) lets the pool's reaper
+    kill the worker if the job outlives `timeout`.
+    """
+    isolation = _JobIsolation()
+    _limit_cpu(timeout + TRACE_JOB_GRACE_SECONDS)
+    running[job_id] = (os.getpid(), time.time() + timeout)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        isolation.restore()
+        running.pop(job_id, None)
+
+
+def trace_job_timeout(options: dict) -> float:
+    """Hard timeout of a trace job: its own time limit plus the grace period."""
+    return resolve_trace_limits(options.get("trace_limits"))["max_seconds"] + TRACE_JOB_GRACE_SECONDS
+
+
+class StreamAborted(BaseException):
+    """
+    Raised inside a streaming job when nobody reads its steps any more.
+    A BaseException so a student's `except Exception:` can't swallow it
+    (and re-raised by the tracer if a bare `except:` does).
+    """
+
+
+def _stream_trace_job(step_queue, code: str, inputs: list, options: dict) -> dict:
+    batch = []
+    sent_first = False
+    aborted = False
+
+    def put(item):
+        nonlocal aborted
+        if aborted:
+            raise StreamAborted()
+        try:
+            step_queue.put(item, timeout=STREAM_PUT_TIMEOUT)
+        except queue.Full:
+            aborted = True
+            raise StreamAborted()
+
+    def on_step(step):
+        nonlocal sent_first
+        batch.append(step)
+        # Send the very first step right away, then in batches
+        if len(batch) >= STREAM_BATCH_SIZE or not sent_first:
+            put(("steps", list(batch)))
+            batch.clear()
+            sent_first = True
+
+    try:
+        result = trace_python_code(code, inputs, on_step=on_step, **options)
+        if batch:
+            put(("steps", batch))
+        put(("result", result))
+    except StreamAborted:
+        return {"aborted": True}
+    return {"aborted": False}
+
+
+def _mp_context():
+    # Forking a running uvicorn process (threads, event loop) is unsafe, so
+    # prefer a forkserver that already has the tracer imported.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["backend.tracer"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+class TraceWorkerPool:
+    """
+    A pool of warm worker processes that run traces off the event loop.
+
+    Every job runs alone in its worker process, so the tracer's swaps of
+    sys.stdout and sys.settrace never mix output between requests, and
+    independent traces run in parallel across cores. Process state a job
+    changes is restored after it (_JobIsolation), and a job that runs past
+    its hard timeout has its worker killed. Killing a worker breaks the
+    whole executor, so the other jobs it took down are run again on the
+    replacement pool.
+    """
+
+    def __init__(self, workers: int = TRACE_WORKERS, queue_limit: int = TRACE_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.queue_limit = max(self.workers, queue_limit)
+        self._executor = None
+        self._manager = None
+        self._pending = 0
+        self._running = None  # Manager dict: job id -> (worker pid, deadline)
+        self._job_ids = itertools.count()
+        self._reaper = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._killed_jobs = set()  # Jobs the reaper killed (not run again)
+        self._reaped = weakref.WeakSet()  # Executors broken by the reaper
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Start the worker processes and wait until each one is ready."""
+        with self._start_lock:
+            if self._executor is not None:
+                return
+            ctx = _mp_context()
+            with _secrets_hidden():
+                if ctx.get_start_method() == "forkserver":
+                    from multiprocessing import forkserver
+                    forkserver.ensure_running()
+                if self._manager is None:
+                    self._manager = ctx.Manager()
+                    self._running = self._manager.dict()
+            if self._reaper is None or not self._reaper.is_alive():
+                self._stopping.clear()
+                self._reaper = threading.Thread(target=self._reap, name="trace-reaper", daemon=True)
+                self._reaper.start()
+            options = {}
+            if TRACE_WORKER_MAX_TASKS > 0:
+                options["max_tasks_per_child"] = TRACE_WORKER_MAX_TASKS
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                **options,
+            )
+            # Warm up: make the executor spawn every worker now, not on first request.
+            for future in [executor.submit(_ping) for _ in range(self.workers)]:
+                future.result()
+            self._executor = executor
+
+    def _reap(self):
+        """
+        Kill workers whose job outlived its hard timeout: a program that
+        keeps catching the tracer's limit exceptions, or a long call into C
+        that no limit check (and no thread in the worker) can interrupt.
+        The pool breaks and is replaced, as after any crash.
+        """
+        while not self._stopping.wait(REAPER_INTERVAL):
+            try:
+                jobs = self._running.items()
+            except Exception:
+                continue  # Manager shutting down
+            now = time.time()
+            for job_id, (pid, deadline) in jobs:
+                if now > deadline:
+                    print(f"Trace job ran past its hard timeout, killing worker {pid}.")
+                    self._running.pop(job_id, None)
+                    self._killed_jobs.add(job_id)
+                    if self._executor is not None:
+                        self._reaped.add(self._executor)
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._running = None
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Reserve a place in the queue for one job."""
+        if self._pending >= self.queue_limit:
+            raise PoolBusyError(f"Trace queue is full ({self._pending} jobs pending)")
+
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def _ready_executor(self) -> ProcessPoolExecutor:
+        executor = self._executor
+        if executor is None:
+            # Spawning the workers takes a while; don't hold up the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+            executor = self._executor
+        return executor
+
+    def _broken(self, executor: ProcessPoolExecutor, job_id: int) -> bool:
+        """
+        Clean up after `executor` broke under this job. Returns True when the
+        job should run again: the reaper broke the pool by killing another job.
+        """
+        if executor is self._executor:
+            # A job killed its worker (os._exit, segfault, the reaper ...);
+            # replace the pool so later requests are not affected
+            print("Trace worker pool broke, restarting it.")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._running.pop(job_id, None)  # Its worker is gone; don't let the reaper find the pid
+        if job_id in self._killed_jobs:
+            self._killed_jobs.discard(job_id)
+            return False
+        return executor in self._reaped
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` in a worker process (killed after TRACE_JOB_TIMEOUT).
+        Raises PoolBusyError when the queue-depth limit is reached.
+        """
+        return await self._run_with_timeout(TRACE_JOB_TIMEOUT, fn, *args, **kwargs)
+
+    async def _run_with_timeout(self, timeout: float, fn, *args, **kwargs):
+        async with self._slot():
+            loop = asyncio.get_running_loop()
+            job_id = next(self._job_ids)
+            while True:
+                executor = await self._ready_executor()
+                job = functools.partial(_run_job, self._running, job_id, timeout, fn, *args, **kwargs)
+                try:
+                    return await loop.run_in_executor(executor, job)
+                except BrokenProcessPool:
+                    if not self._broken(executor, job_id):
+                        raise
+
+    async def trace(self, code: str, inputs: list, **options) -> dict:
+        return await self._run_with_timeout(trace_job_timeout(options), trace_python_code, code, inputs, **options)
+
+    async def stream_trace(self, code: str, inputs: list, **options):
+        """
+        Async generator over a trace as it runs in a worker.
+        Yields ("steps", [step, ...]) batches, then a final ("result", trace_data)
+        where trace_data has an empty "steps" list.
+        """
+        async with self._slot():
+            loop = asyncio.get_running_loop()
+            job_id = next(self._job_ids)
+            # Blocked puts (a slow reader) count against the trace's time limit,
+            # except for the last two
+            timeout = trace_job_timeout(options) + 2 * STREAM_PUT_TIMEOUT
+            sent = False
+            while True:
+                executor = await self._ready_executor()
+                step_queue = self._manager.Queue(maxsize=STREAM_QUEUE_SIZE)
+                job = loop.run_in_executor(
+                    executor, functools.partial(
+                        _run_job, self._running, job_id, timeout, _stream_trace_job, step_queue, code, inputs, options,
+                    ),
+                )
+                get = functools.partial(step_queue.get, timeout=0.1)
+                try:
+                    while True:
+                        try:
+                            kind, payload = await loop.run_in_executor(None, get)
+                        except queue.Empty:
+                            if job.done():
+                                job.result()  # surfaces BrokenProcessPool and friends
+                                return
+                            continue
+                        sent = True
+                        yield kind, payload
+                        if kind == "result":
+                            break
+                    await job
+                    return
+                except BrokenProcessPool:
+                    # Steps already sent can't be taken back, so only a job
+                    # that hadn't sent any is run again
+                    if not self._broken(executor, job_id) or sent:
+                        raise
+
+
+# Shared pool used by the API (started in the app lifespan)
+trace_pool = TraceWorkerPool()
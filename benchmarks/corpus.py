@@ -0,0 +1,141 @@
+"""Student programs traced by the tracer benchmarks (fixed, deterministic)."""
+
+BUBBLE_SORT = """
+numbers = [29, 3, 71, 15, 42, 8, 64, 23, 50, 1, 37, 90, 12, 58, 6, 81, 33, 19, 77, 45]
+n = len(numbers)
+for i in range(n):
+    for j in range(0, n - i - 1):
+        if numbers[j] > numbers[j + 1]:
+            numbers[j], numbers[j + 1] = numbers[j + 1], numbers[j]
+print(numbers)
+"""
+
+MERGE_SORT = """
+def merge_sort(items):
+    if len(items) <= 1:
+        return items
+    mid = len(items) // 2
+    left = merge_sort(items[:mid])
+    right = merge_sort(items[mid:])
+    merged = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            merged.append(left[i])
+            i += 1
+        else:
+            merged.append(right[j])
+            j += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return merged
+
+data = [(i * 37) % 101 for i in range(64)]
+print(merge_sort(data))
+"""
+
+FIBONACCI = """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+memo = {}
+def fib_memo(n):
+    if n in memo:
+        return memo[n]
+    memo[n] = n if n < 2 else fib_memo(n - 1) + fib_memo(n - 2)
+    return memo[n]
+
+print(fib(12), fib_memo(60))
+"""
+
+GRAPH_BFS = """
+from collections import deque
+
+graph = {}
+for node in range(60):
+    graph[node] = [(node * 7 + 1) % 60, (node * 11 + 3) % 60, (node + 1) % 60]
+
+def bfs(start):
+    visited = {start}
+    queue = deque([start])
+    order = []
+    while queue:
+        node = queue.popleft()
+        order.append(node)
+        for neighbor in graph[node]:
+            if neighbor not in visited:
+                visited.add(neighbor)
+                queue.append(neighbor)
+    return order
+
+print(bfs(0))
+"""
+
+BINARY_SEARCH_TREE = """
+class Node:
+    def __init__(self, value):
+        self.value = value
+        self.left = None
+        self.right = None
+
+class BST:
+    def __init__(self):
+        self.root = None
+
+    def insert(self, value):
+        if self.root is None:
+            self.root = Node(value)
+            return
+        current = self.root
+        while True:
+            if value < current.value:
+                if current.left is None:
+                    current.left = Node(value)
+                    return
+                current = current.left
+            else:
+                if current.right is None:
+                    current.right = Node(value)
+                    return
+                current = current.right
+
+    def inorder(self, node, out):
+        if node is not None:
+            self.inorder(node.left, out)
+            out.append(node.value)
+            self.inorder(node.right, out)
+        return out
+
+tree = BST()
+for value in [50, 30, 70, 20, 40, 60, 80, 35, 45, 65, 75, 85, 10, 25, 55]:
+    tree.insert(value)
+print(tree.inorder(tree.root, []))
+"""
+
+LINKED_LIST = """
+class ListNode:
+    def __init__(self, value, next=None):
+        self.value = value
+        self.next = next
+
+head = None
+for value in range(40):
+    head = ListNode(value, head)
+
+prev = None
+current = head
+while current:
+    current.next, prev, current = prev, current, current.next
+head = prev
+"""
+
+PROGRAMS = {
+    "bubble_sort": BUBBLE_SORT,
+    "merge_sort": MERGE_SORT,
+    "fibonacci": FIBONACCI,
+    "graph_bfs": GRAPH_BFS,
+    "binary_search_tree": BINARY_SEARCH_TREE,
+    "linked_list": LINKED_LIST,
+}
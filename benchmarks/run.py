@@ -0,0 +1,200 @@
+"""
+Benchmarks for the tracer, the serializer and the algorithm step generators.
+
+Each case reports its best wall-clock time over --repeat runs, the peak
+memory allocated during one run (tracemalloc) and the JSON size of its
+output. Results can be saved as a baseline and later runs compared to it:
+
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+With --compare the exit status is 1 when any case got slower, hungrier or
+bigger than the tolerances allow. Baselines are machine-specific: compare
+only against one recorded on the same hardware.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from backend.algorithms.bfs import bfs_events, bfs_steps
+from backend.algorithms.dfs import dfs_events, dfs_steps
+from backend.algorithms.graph import CSRGraph
+from backend.algorithms.wavearray import wavearray_steps
+from backend.tracer import TRACE_FORMAT_V2, make_serializable, resolve_snapshot_limits, trace_python_code
+from benchmarks.corpus import PROGRAMS
+
+# Allowed growth over the baseline before a case counts as a regression
+DEFAULT_TIME_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.10
+DEFAULT_BYTES_TOLERANCE = 0.0  # Output is deterministic
+# Time changes smaller than this are noise, whatever the percentage
+MIN_TIME_DELTA = 0.002
+
+GRAPH_SIZES = (100, 1000, 3000)
+EVENT_GRAPH_SIZES = (10_000, 100_000)
+WAVEARRAY_SIZES = (1_000, 100_000)
+
+
+class _Node:
+    def __init__(self, value, next=None):
+        self.value = value
+        self.next = next
+
+
+def _random_graph(n: int, degree: int = 3, seed: int = 0) -> Dict[int, List[int]]:
+    rng = random.Random(seed)
+    return {u: [rng.randrange(n) for _ in range(degree)] for u in range(n)}
+
+
+def _random_csr(n: int, degree: int = 5, seed: int = 0) -> CSRGraph:
+    rng = random.Random(seed)
+    return CSRGraph.from_edges(n, [(rng.randrange(n), rng.randrange(n)) for _ in range(n * degree)], directed=False)
+
+
+def _serializer_inputs() -> Dict[str, Any]:
+    chain = None
+    for value in range(5000):
+        chain = _Node(value, chain)
+    return {
+        "wide_list": list(range(100_000)),
+        "nested_dict": {f"k{i}": {f"j{j}": [i, j, {"deep": [i] * 5}] for j in range(50)} for i in range(200)},
+        "node_chain": chain,
+        "mixed": {"set": set(range(5000)), "tuples": [(i, str(i)) for i in range(5000)], "matrix": [[0] * 100] * 100},
+    }
+
+
+def _trace(code: str, **options) -> Dict[str, Any]:
+    result = trace_python_code(code, **options)
+    result.pop("timings", None)  # Wall-clock numbers would make output_bytes vary
+    return result
+
+
+def build_cases() -> List[Tuple[str, Callable[[], Any]]]:
+    """(name, zero-argument callable returning the output) for every case."""
+    cases = []
+    for name, code in PROGRAMS.items():
+        cases.append((f"tracer/{name}", lambda code=code: _trace(code)))
+        cases.append((f"tracer/{name}/v2", lambda code=code: _trace(code, trace_format=TRACE_FORMAT_V2)))
+
+    limits = resolve_snapshot_limits()
+    for name, value in _serializer_inputs().items():
+        cases.append((f"serializer/{name}", lambda value=value: make_serializable(value, limits, ("value",), [limits["max_nodes"]])))
+        cases.append((f"serializer/{name}/unlimited", lambda value=value: make_serializable(value)))
+
+    for n in GRAPH_SIZES:
+        graph = _random_graph(n)
+        cases.append((f"algorithms/bfs_steps/{n}", lambda graph=graph: bfs_steps(graph, 0)))
+        cases.append((f"algorithms/dfs_steps/{n}", lambda graph=graph: dfs_steps(graph, 0)))
+    for n in EVENT_GRAPH_SIZES:
+        csr = _random_csr(n)
+        cases.append((f"algorithms/bfs_events/{n}", lambda csr=csr: list(bfs_events(csr, 0))))
+        cases.append((f"algorithms/dfs_events/{n}", lambda csr=csr: list(dfs_events(csr, 0))))
+    for n in WAVEARRAY_SIZES:
+        numbers = list(range(n))
+        cases.append((f"algorithms/wavearray_steps/{n}", lambda numbers=numbers: wavearray_steps(numbers)))
+    return cases
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    output = fn()  # Warm-up; also the output that gets sized
+    output_bytes = len(json.dumps(output, default=str))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    # Separate run: tracemalloc slows allocation down a lot
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "median_seconds": statistics.median(times),
+        "peak_bytes": peak,
+        "output_bytes": output_bytes,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerances: Dict[str, float]) -> List[str]:
+    """Human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric, tolerance in tolerances.items():
+            old, new = before.get(metric), result[metric]
+            if metric == "seconds" and new - (old or 0) < MIN_TIME_DELTA:
+                continue
+            if old and new > old * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {old:,.4g} -> {new:,.4g} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print_table(results: Dict[str, dict], baseline: Dict[str, dict]):
+    print(f"{'case':<42} {'time ms':>10} {'vs base':>8} {'peak KiB':>10} {'output KiB':>11}")
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("seconds")
+        change = f"{(result['seconds'] / before - 1) * 100:+.0f}%" if before else ""
+        print(
+            f"{name:<42} {result['seconds'] * 1000:>10.2f} {change:>8} "
+            f"{result['peak_bytes'] / 1024:>10.0f} {result['output_bytes'] / 1024:>11.1f}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (best one is kept)")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="baseline to compare against")
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument("--bytes-tolerance", type=float, default=DEFAULT_BYTES_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, fn in build_cases():
+        if args.filter in name:
+            results[name] = measure(fn, max(1, args.repeat))
+    _print_table(results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        regressions = compare(results, baseline, {
+            "seconds": args.time_tolerance,
+            "peak_bytes": args.memory_tolerance,
+            "output_bytes": args.bytes_tolerance,
+        })
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
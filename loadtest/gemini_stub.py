@@ -0,0 +1,107 @@
+"""
+Local stand-in for the Gemini generateContent API, for load tests.
+
+    python -m loadtest.gemini_stub --port 8090 --latency-ms 400 --error-rate 0.02
+    AI_BASE_URL=http://127.0.0.1:8090 uvicorn backend.main:app
+
+Answers every generateContent / streamGenerateContent call with canned
+text after a configurable delay, and fails a configurable share of calls.
+JSON-mode requests (the variable mapper) get "{}".
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CANNED_TEXT = (
+    "This line stores a value in a variable so the program can use it later. "
+    "Each step builds on the previous one, which is how the final result is reached."
+)
+
+# Knobs, set from the command line
+settings = {
+    "latency_ms": 300.0,      # Mean delay before the answer (or first chunk)
+    "jitter_ms": 100.0,       # Uniform +/- spread around the mean
+    "error_rate": 0.0,        # Share of calls answered with error_status
+    "error_status": 503,
+    "stream_chunks": 5,       # Pieces a streamed answer is split into
+    "chunk_interval_ms": 50.0,
+}
+stats = {"calls": 0, "errors": 0}
+
+app = FastAPI(title="Gemini stub")
+
+
+def _delay() -> float:
+    spread = settings["jitter_ms"]
+    return max(0.0, settings["latency_ms"] + random.uniform(-spread, spread)) / 1000
+
+
+def _answer_text(payload: dict) -> str:
+    config = payload.get("generationConfig") or {}
+    if config.get("responseMimeType") == "application/json":
+        return "{}"
+    return CANNED_TEXT
+
+
+def _response_body(text: str) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def generate(model_action: str, request: Request):
+    _, _, action = model_action.partition(":")
+    if action not in ("generateContent", "streamGenerateContent"):
+        raise HTTPException(status_code=404, detail=f"Unknown action: {action}")
+    payload = await request.json()
+    stats["calls"] += 1
+
+    await asyncio.sleep(_delay())
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        status = settings["error_status"]
+        return JSONResponse({"error": {"code": status, "message": "Injected error"}}, status_code=status)
+
+    text = _answer_text(payload)
+    if action == "generateContent":
+        return _response_body(text)
+
+    async def events():
+        count = max(1, settings["stream_chunks"])
+        size = -(-len(text) // count)
+        for i in range(0, len(text), size):
+            if i:
+                await asyncio.sleep(settings["chunk_interval_ms"] / 1000)
+            yield f"data: {json.dumps(_response_body(text[i:i + size]))}\r\n\r\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "settings": settings}
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    parser.add_argument("--error-status", type=int, default=settings["error_status"])
+    parser.add_argument("--stream-chunks", type=int, default=settings["stream_chunks"])
+    parser.add_argument("--chunk-interval-ms", type=float, default=settings["chunk_interval_ms"])
+    args = parser.parse_args(argv)
+    for key in settings:
+        settings[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
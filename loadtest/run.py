@@ -0,0 +1,150 @@
+"""
+Async load generator for the API.
+
+    python -m loadtest.run --url http://127.0.0.1:8000 --concurrency 32 --duration 60 \
+        --mix visualize=6,explain=3,summarize=1
+
+Runs `--concurrency` clients in a closed loop, each picking the next request
+type at random by the weights in --mix, for --duration seconds (or until
+--requests have been sent). Reports p50/p95/p99 latency, throughput and the
+error rate per request type. Point the API at loadtest.gemini_stub first so
+the AI calls don't reach the real service.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.corpus import PROGRAMS
+
+ENDPOINTS = {
+    "visualize": "/python/visualize",
+    "explain": "/python/explain",
+    "summarize": "/python/summarize",
+}
+DEFAULT_MIX = "visualize=6,explain=3,summarize=1"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown request type in --mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def build_payload(kind: str, n: int, unique: bool) -> dict:
+    """Request body number n. `unique` defeats the trace and AI caches."""
+    name = random.choice(list(PROGRAMS))
+    code = PROGRAMS[name]
+    if kind == "visualize":
+        # Inputs are part of the trace cache key and unused by the programs
+        return {"code": code, "inputs": [str(n)] if unique else []}
+    if kind == "explain":
+        lines = [line.strip() for line in code.splitlines() if line.strip()]
+        line = random.choice(lines)
+        return {"code_line": f"{line}  # {n}" if unique else line}
+    final_step = {"line": None, "event": "finished", "variables": {}, "output": ""}
+    return {"code": f"{code}\n# {n}" if unique else code, "trace": [final_step]}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+async def run_load(url: str, concurrency: int, duration: float, total: int, weights: Dict[str, float],
+                   unique: bool, timeout: float) -> Dict[str, dict]:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(lambda: defaultdict(int))
+    kinds, kind_weights = list(weights), list(weights.values())
+    sent = 0
+    deadline = time.monotonic() + duration
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal sent
+        while time.monotonic() < deadline and (total <= 0 or sent < total):
+            sent += 1
+            kind = random.choices(kinds, kind_weights)[0]
+            payload = build_payload(kind, sent, unique)
+            start = time.perf_counter()
+            try:
+                response = await http.post(ENDPOINTS[kind], json=payload)
+                status = str(response.status_code)
+                failed = response.status_code >= 400
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+                failed = True
+            latencies[kind].append(time.perf_counter() - start)
+            statuses[kind][status] += 1
+            if failed:
+                errors[kind] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    started = time.monotonic()
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as http:
+        await asyncio.gather(*[client(http) for _ in range(concurrency)])
+    elapsed = time.monotonic() - started
+
+    report = {}
+    for kind in list(latencies) + ["all"]:
+        values = sorted(sum(latencies.values(), []) if kind == "all" else latencies[kind])
+        failed = sum(errors.values()) if kind == "all" else errors[kind]
+        report[kind] = {
+            "requests": len(values),
+            "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+            "error_rate": failed / len(values) if values else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+        if kind != "all":
+            report[kind]["statuses"] = dict(statuses[kind])
+    return report
+
+
+def _print_report(report: Dict[str, dict]):
+    print(f"{'type':<11} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, row in report.items():
+        print(
+            f"{kind:<11} {row['requests']:>9} {row['throughput_rps']:>8.1f} {row['error_rate'] * 100:>6.1f}% "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the API")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no limit)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="request types and their weights")
+    parser.add_argument("--unique", action="store_true", help="make every request miss the server caches")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(
+        args.url, max(1, args.concurrency), args.duration, args.requests,
+        parse_mix(args.mix), args.unique, args.timeout,
+    ))
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
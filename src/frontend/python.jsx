@@ -979,9 +979,12 @@ export default function Python() {
             const stepsArray = Array.isArray(data.steps) ? data.steps : [];
             const varMap = (data.variable_map && typeof data.variable_map === 'object') ? data.variable_map : {};
 
+            // Steps only carry the newly printed text; rebuild the running output here.
+            let outputSoFar = '';
             const formattedTrace = stepsArray.map(step => {
                 const currentVars = (step && typeof step.variables === 'object' && step.variables !== null) ? step.variables : {};
-                const output = (step && typeof step.output === 'string') ? step.output : '';
+                if (step && typeof step.output_chunk === 'string') outputSoFar += step.output_chunk;
+                const output = (step && typeof step.output === 'string') ? step.output : outputSoFar;
                 const line = (step && typeof step.line === 'number') ? step.line : null;
                 const event = (step && typeof step.event === 'string') ? step.event : 'line';
                 // --- Store the map in *every* step for convenience ---
@@ -991,6 +994,13 @@ export default function Python() {
             setTrace(formattedTrace || []);
             setVariableMap(varMap); // <-- Store the map from the AI
 
+            // Explain every line in one call now, so clicking a line is answered from the cache
+            fetch(`${API_PYTHON_URL}/explain/batch`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ code }),
+            }).catch(() => {});
+
         } catch (e) {
             setError(`Failed to connect to the server: ${e.message}`);
             setTrace([]);
@@ -1016,7 +1026,8 @@ export default function Python() {
             const response = await fetch(`${API_PYTHON_URL}/explain`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ code_line: lineContent }),
+                // code + line_number hit the per-line cache; code_line is the fallback
+                body: JSON.stringify({ code, line_number: lineNumber, code_line: lineContent }),
             });
             if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
             const data = await response.json();
@@ -1043,8 +1054,8 @@ export default function Python() {
             const response = await fetch(`${API_PYTHON_URL}/summarize`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                // Send the full code and the full trace
-                body: JSON.stringify({ code, trace }),
+                // Only the final step is used, so don't upload the whole trace
+                body: JSON.stringify({ code, trace: trace.slice(-1) }),
             });
             if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
             const data = await response.json();
@@ -54,4 +54,36 @@ export function oklabToRgb(oklab) {
     b2 = Math.round(Math.min(Math.max(0, f(b2)), 1) * 255);
 
     return `rgb(${r}, ${g}, ${b2})`;
-}
\ No newline at end of file
+}
+// Expand a v2 (keyframe + delta) trace into full-state v1 steps.
+// v1 traces are returned unchanged, so callers can use this for both formats.
+export function expandTraceSteps(data) {
+    const steps = Array.isArray(data?.steps) ? data.steps : [];
+    if (data?.format !== 2) return steps;
+
+    let current = {};
+    let currentHeap = null; // Only present in "heap" snapshot mode
+    return steps.map(step => {
+        if (step.variables) {
+            current = { ...step.variables };
+            if (step.heap) currentHeap = { ...step.heap };
+        } else {
+            current = { ...current, ...(step.changed || {}) };
+            (step.deleted || []).forEach(name => { delete current[name]; });
+            if (currentHeap) {
+                currentHeap = { ...currentHeap, ...(step.heap_changed || {}) };
+                (step.heap_deleted || []).forEach(ref => { delete currentHeap[ref]; });
+            }
+        }
+        const { keyframe, changed, deleted, heap_changed, heap_deleted, ...rest } = step;
+        return currentHeap ? { ...rest, variables: current, heap: currentHeap } : { ...rest, variables: current };
+    });
+}
+
+// Fetch full-state steps from..to (inclusive) of a trace stored server-side
+// (requested with `store: true`), so long traces can be scrubbed window by window.
+export async function fetchTraceSteps(baseUrl, traceId, from, to) {
+    const res = await fetch(`${baseUrl}/python/trace/${traceId}/steps?from=${from}&to=${to}`);
+    if (!res.ok) throw new Error(`Trace window request failed: ${res.status}`);
+    return res.json();
+}